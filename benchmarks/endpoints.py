@@ -0,0 +1,315 @@
+"""
+Benchmark de todas las rutas de src/main.py con el test client de Flask, en secuencia y con
+varios hilos en paralelo. Crea y llena una base local (SQLite por defecto, o la de --database-url)
+y guarda latencias p50/p95/p99, throughput, consultas SQL y memoria máxima en un JSON
+que se puede comparar entre cambios.
+
+    python benchmarks/endpoints.py --stations 100 --measures 10 --days 365 --output baseline.json
+    python benchmarks/endpoints.py --stations 10 --measures 3 --days 30 --compare baseline.json
+
+Si la base ya tiene estaciones no se vuelve a llenar, así se puede repetir sobre los mismos datos:
+las claves únicas de las rutas de escritura llevan un sufijo distinto en cada corrida y las
+políticas de retención se crean solo para mediciones que todavía no tienen una.
+Las rutas DELETE y /fill no se miden porque cambian los datos de las demás.
+Las consultas se leen del header Server-Timing; en ?stream=1 se ejecutan después de armar los
+headers, por eso ahí figuran 0.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src')
+QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+DATE_FROM = datetime.datetime(2018, 1, 1)
+
+
+def seed(db, models, stations, measures, days, interval):
+    """
+    Crea organización, persona, estaciones, medidas, todas las asignaciones y sus lecturas
+    """
+    from generator import fill_series
+
+    if db.session.query(models.Station.id).first() is not None:
+        print('la base ya tiene datos, no se vuelve a llenar')
+        return
+    db.session.add(models.Organization(name='bench', address='bench', phone='bench', email='bench@example.com'))
+    db.session.add(models.Person(username='bench', email='bench@example.com', organization_id=1))
+    db.session.flush()
+    # bulk_insert_mappings no pasa por los validadores del modelo: lat/lon van explícitos
+    db.session.bulk_insert_mappings(models.Station, [
+        {'name': 'Estación%d' % i, 'lattitude': str(-34 - i / 1000.0), 'longitude': str(-58 - i / 1000.0),
+         'lat': -34 - i / 1000.0, 'lon': -58 - i / 1000.0, 'streetaddress': 'calle%d' % i, 'numberaddress': str(i), 'person_id': 1, 'organization_id': 1, 'description': ''}
+        for i in range(1, stations + 1)
+    ])
+    db.session.bulk_insert_mappings(models.Measure, [
+        {'name': 'medida%d' % i, 'unit': 'unidad%d' % i, 'symbol': 'símbolo%d' % i}
+        for i in range(1, measures + 1)
+    ])
+    db.session.bulk_insert_mappings(models.Assignedmeasure, [
+        {'station_id': s, 'measure_id': m} for s in range(1, stations + 1) for m in range(1, measures + 1)
+    ])
+    db.session.commit()
+
+    started = time.perf_counter()
+    inserted = fill_series({
+        'date_from': DATE_FROM, 'date_to': DATE_FROM + datetime.timedelta(days=days),
+        'interval': interval, 'seed': 1
+    })
+    print('%d lecturas insertadas en %.1f s' % (inserted, time.perf_counter() - started))
+
+
+def scenarios(stations, measures, days, run, free_series):
+    """
+    (nombre, método, url, cuerpo) por ruta; los cuerpos dependen de un contador y del sufijo run de la
+    corrida para no repetir claves únicas. free_series son las mediciones asignadas sin política de retención.
+    """
+    last = DATE_FROM + datetime.timedelta(days=days)
+    day = DATE_FROM + datetime.timedelta(days=days // 2)
+    fmt = lambda d: d.strftime('%Y%m%d%H%M%S')
+    one_day = '/assignedmeasures/1/1/%s/%s' % (fmt(day), fmt(day + datetime.timedelta(days=1)))
+    one_month = '/assignedmeasures/1/1/%s/%s' % (fmt(day), fmt(day + datetime.timedelta(days=30)))
+    everything = '/assignedmeasures/1/1/%s/%s' % (fmt(DATE_FROM), fmt(last))
+    series = [{'station_id': s, 'measure_id': 1} for s in range(1, min(stations, 10) + 1)]
+    readings = lambda n: [
+        {'assignedmeasure_id': 1 + (n + k) % (stations * measures), 'data_time_measure': (last + datetime.timedelta(minutes=n * 100 + k)).isoformat(), 'data_value': k}
+        for k in range(100)
+    ]
+
+    reads = [
+        ('sitemap', 'GET', '/', None),
+        ('organizations', 'GET', '/organizations', None),
+        ('organizations_page', 'GET', '/organizations?limit=100', None),
+        ('organization_people', 'GET', '/organizations/1/people', None),
+        ('persons', 'GET', '/persons', None),
+        ('organizations_expand', 'GET', '/organizations?expand=persons.stations.assignedMeasures.measure&limit=10', None),
+        ('stations_expand', 'GET', '/stations?expand=assignedMeasures.measure&limit=100', None),
+        ('stations', 'GET', '/stations', None),
+        ('stations_page', 'GET', '/stations?limit=100', None),
+        ('station', 'GET', '/stations/1', None),
+        ('station_measures', 'GET', '/stations/1/measures', None),
+        ('station_dashboard', 'GET', '/stations/1/dashboard', None),
+        ('station_dashboard_week', 'GET', '/stations/1/dashboard?hours=168&bucket=hour', None),
+        ('stations_bbox', 'GET', '/stations/bbox?min_lat=-35&max_lat=-34&min_lon=-59&max_lon=-58', None),
+        ('stations_bbox_latest', 'GET', '/stations/bbox?min_lat=-35&max_lat=-34&min_lon=-59&max_lon=-58&latest=1', None),
+        ('stations_nearest', 'GET', '/stations/nearest?lat=-34.05&lon=-58.05&k=10', None),
+        ('stations_nearest_latest', 'GET', '/stations/nearest?lat=-34.05&lon=-58.05&k=10&latest=1', None),
+        ('measures', 'GET', '/measures', None),
+        ('measure', 'GET', '/measures/1', None),
+        ('measure_stations', 'GET', '/measures/1/stations', None),
+        ('assignedmeasures', 'GET', '/assignedmeasures', None),
+        ('assignedmeasures_page', 'GET', '/assignedmeasures?limit=100', None),
+        ('range_day', 'GET', one_day, None),
+        ('range_month', 'GET', one_month, None),
+        ('range_month_columns', 'GET', one_month + '?format=columns', None),
+        ('range_month_page', 'GET', one_month + '?limit=1000', None),
+        ('range_month_stream', 'GET', one_month + '?stream=1', None),
+        ('range_all_max_points', 'GET', everything + '?max_points=500', None),
+        ('range_all_bucket_day', 'GET', everything + '?bucket=day', None),
+        ('range_month_bucket_hour', 'GET', one_month + '?bucket=hour', None),
+        ('range_all_bucket_auto', 'GET', everything + '?bucket=auto', None),
+        ('last', 'GET', '/assignedmeasures/last', None),
+        ('retentionpolicies', 'GET', '/retentionpolicies', None),
+        ('data_storage', 'GET', '/data/storage', None),
+        ('data_buffer_stats', 'GET', '/data/buffer', None),
+        ('cache_stats', 'GET', '/cache/stats', None),
+        ('metrics', 'GET', '/metrics', None),
+        ('data_query', 'POST', '/data/query', lambda n: {
+            'series': series, 'date_from': day.isoformat(), 'date_to': (day + datetime.timedelta(days=30)).isoformat()}),
+        ('data_query_bucket', 'POST', '/data/query', lambda n: {
+            'series': series, 'date_from': DATE_FROM.isoformat(), 'date_to': last.isoformat(), 'bucket': 'day'}),
+    ]
+    writes = [
+        ('create_organization', 'POST', '/organizations', lambda n: {
+            'name': 'org%d-%s' % (n, run), 'address': 'dir%d-%s' % (n, run), 'phone': 'tel%d-%s' % (n, run), 'email': 'org%d-%s@example.com' % (n, run)}),
+        ('create_person', 'POST', '/persons', lambda n: {'username': 'user%d-%s' % (n, run), 'email': 'user%d-%s@example.com' % (n, run), 'organization_id': 1}),
+        # symbol admite 10 caracteres: 4 del sufijo y el contador en hexadecimal
+        ('create_measure', 'POST', '/measures', lambda n: {'name': 'm%d' % n, 'unit': 'u%d-%s' % (n, run), 'symbol': '%s%x' % (run[:4], n)}),
+        ('update_station', 'PUT', '/stations/1', lambda n: {'description': 'bench %d' % n}),
+        ('update_measure', 'PUT', '/measures/1', lambda n: {'name': 'medida1'}),
+        ('create_retentionpolicy', 'POST', '/retentionpolicies', lambda n: {'assignedmeasure_id': free_series[n % len(free_series)], 'raw_days': 3650}),
+        ('data_batch', 'POST', '/data/batch', readings),
+        ('data_buffer', 'POST', '/data/buffer', lambda n: readings(n + 1000000)),
+    ]
+    return reads, writes
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))]
+
+
+def summary(timings, elapsed):
+    return {
+        'requests': len(timings),
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'throughput_rps': round(len(timings) / elapsed, 1) if elapsed else None,
+    }
+
+
+def peak_rss_kb():
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def call(client, method, url, body, n):
+    started = time.perf_counter()
+    response = client.open(url, method=method, json=body(n) if body else None)
+    response.get_data()
+    elapsed = (time.perf_counter() - started) * 1000
+    match = QUERIES_RE.search(response.headers.get('Server-Timing', ''))
+    return elapsed, response.status_code, int(match.group(1)) if match else None
+
+
+def run_sequential(app, items, repeat, counter):
+    client = app.test_client()
+    results = {}
+    for name, method, url, body in items:
+        timings, statuses, queries = [], set(), None
+        started = time.perf_counter()
+        for _ in range(repeat):
+            counter[0] += 1
+            elapsed, status, queries = call(client, method, url, body, counter[0])
+            timings.append(elapsed)
+            statuses.add(status)
+        result = summary(timings, time.perf_counter() - started)
+        result.update({'method': method, 'url': url, 'status': sorted(statuses), 'queries': queries, 'peak_rss_kb': peak_rss_kb()})
+        results[name] = result
+        print('  %-26s p50 %8.2f ms  p95 %8.2f ms  p99 %8.2f ms  %4s consultas  %s' % (
+            name, result['p50_ms'], result['p95_ms'], result['p99_ms'], queries, result['status']))
+    return results
+
+
+def run_load(app, items, threads, duration):
+    """
+    threads hilos eligen rutas de lectura al azar durante duration segundos
+    """
+    timings, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(index):
+        client = app.test_client()
+        rng = random.Random(index)
+        local, failed = [], 0
+        while time.perf_counter() < deadline:
+            name, method, url, body = rng.choice(items)
+            elapsed, status, _ = call(client, method, url, body, index)
+            local.append(elapsed)
+            failed += status >= 500
+        with lock:
+            timings.extend(local)
+            errors[0] += failed
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    result = summary(timings, time.perf_counter() - started)
+    result.update({'threads': threads, 'duration_s': duration, 'errors': errors[0], 'peak_rss_kb': peak_rss_kb()})
+    return result
+
+
+def compare(baseline_path, results):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print('comparación con %s (p50 y p95, actual / base)' % baseline_path)
+    for name, result in results['endpoints'].items():
+        base = baseline.get('endpoints', {}).get(name)
+        if base is None:
+            continue
+        print('  %-26s p50 %6.2fx  p95 %6.2fx  consultas %s -> %s' % (
+            name, result['p50_ms'] / base['p50_ms'] if base['p50_ms'] else float('nan'),
+            result['p95_ms'] / base['p95_ms'] if base['p95_ms'] else float('nan'), base['queries'], result['queries']))
+    if 'load' in baseline and 'load' in results:
+        print('  %-26s %.1f -> %.1f req/s' % ('carga', baseline['load']['throughput_rps'], results['load']['throughput_rps']))
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=SRC, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='Por ejemplo postgresql://localhost/bench (por defecto un archivo SQLite)')
+    parser.add_argument('--sqlite', help='Archivo SQLite a usar o crear (por defecto uno temporal)')
+    parser.add_argument('--stations', type=int, default=100)
+    parser.add_argument('--measures', type=int, default=10)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--interval', type=int, default=3600, help='Segundos entre lecturas')
+    parser.add_argument('--repeat', type=int, default=50, help='Requests por ruta en modo secuencial')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10, help='Segundos del modo con hilos (0 para omitirlo)')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', help='JSON de una corrida anterior para comparar')
+    args = parser.parse_args()
+
+    url = args.database_url or 'sqlite:///' + os.path.abspath(args.sqlite or os.path.join(tempfile.mkdtemp(), 'bench.sqlite'))
+    os.environ['DB_CONNECTION_STRING'] = url
+    sys.path.insert(0, os.path.abspath(SRC))
+    import main as api
+    import models
+
+    app = api.app
+    with app.app_context():
+        models.db.create_all()
+        if models.Tableversion.query.first() is None:
+            models.db.session.add_all([models.Tableversion(name=name, version=0, updated_at=datetime.datetime.utcnow())
+                                       for name in ('station', 'measure', 'assignedmeasure')])
+            models.db.session.commit()
+        seed(models.db, models, args.stations, args.measures, args.days, args.interval)
+        with_policy = models.db.session.query(models.Retentionpolicy.assignedmeasure_id).filter(models.Retentionpolicy.assignedmeasure_id.isnot(None))
+        free_series = [x.id for x in models.Assignedmeasure.query.filter(~models.Assignedmeasure.id.in_(with_policy)).order_by(models.Assignedmeasure.id)]
+
+    reads, writes = scenarios(args.stations, args.measures, args.days, os.urandom(3).hex(), free_series)
+    if len(free_series) < args.repeat:
+        print('create_retentionpolicy omitida: quedan %d mediciones sin política y hacen falta %d' % (len(free_series), args.repeat))
+        writes = [x for x in writes if x[0] != 'create_retentionpolicy']
+    counter = [0]
+    print('secuencial, %d requests por ruta' % args.repeat)
+    endpoints = run_sequential(app, reads + writes, args.repeat, counter)
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'created_at': datetime.datetime.utcnow().isoformat(),
+            'database': url.split(':', 1)[0],
+            'python': platform.python_version(),
+            'stations': args.stations, 'measures': args.measures, 'days': args.days,
+            'interval': args.interval, 'repeat': args.repeat,
+        },
+        'endpoints': endpoints,
+    }
+    if args.duration > 0:
+        print('carga con %d hilos durante %s s' % (args.threads, args.duration))
+        results['load'] = run_load(app, reads, args.threads, args.duration)
+        print('  %(requests)d requests, %(throughput_rps)s req/s, p50 %(p50_ms)s ms, p95 %(p95_ms)s ms, p99 %(p99_ms)s ms, %(errors)d errores' % results['load'])
+    api.write_behind.stop()
+    results['meta']['peak_rss_kb'] = peak_rss_kb()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print('resultados en %s' % args.output)
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == '__main__':
+    main()
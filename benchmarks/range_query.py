@@ -0,0 +1,85 @@
+"""
+Mide la latencia de la consulta por rango de handle_data_measure sobre la tabla data,
+con y sin el indice compuesto (assignedmeasure_id, data_time_measure).
+
+    python benchmarks/range_query.py --rows 1000000 10000000 --series 9
+"""
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+INDEX_NAME = 'ix_data_assignedmeasure_id_data_time_measure'
+RANGE_QUERY = (
+    'SELECT id, data_value, data_time_measure FROM data '
+    'WHERE assignedmeasure_id = ? AND data_time_measure >= ? AND data_time_measure <= ? '
+    'ORDER BY data_time_measure'
+)
+
+
+def seed(conn, rows, series):
+    """
+    Crea la tabla data y la llena con series horarias intercaladas como las de /data/fill
+    """
+    conn.execute('CREATE TABLE data (id INTEGER PRIMARY KEY, data_value FLOAT NOT NULL, '
+                 'data_time_measure DATETIME NOT NULL, assignedmeasure_id INTEGER)')
+    start = datetime.datetime(2018, 1, 1)
+    per_series = rows // series
+    chunk = 50000
+    for offset in range(0, per_series, chunk):
+        batch = []
+        for hour in range(offset, min(offset + chunk, per_series)):
+            date = str(start + datetime.timedelta(hours=hour))
+            for serie in range(1, series + 1):
+                batch.append((random.uniform(-5, 45), date, serie))
+        conn.executemany('INSERT INTO data (data_value, data_time_measure, assignedmeasure_id) VALUES (?, ?, ?)', batch)
+    conn.commit()
+    return start, start + datetime.timedelta(hours=per_series)
+
+
+def measure(conn, start, end, series, repeat):
+    """
+    Ejecuta ventanas de un mes al azar y devuelve las latencias en milisegundos
+    """
+    span = (end - start) - datetime.timedelta(days=30)
+    timings = []
+    for _ in range(repeat):
+        datefrom = start + datetime.timedelta(seconds=random.uniform(0, max(span.total_seconds(), 0)))
+        dateto = datefrom + datetime.timedelta(days=30)
+        t0 = time.perf_counter()
+        conn.execute(RANGE_QUERY, (random.randint(1, series), str(datefrom), str(dateto))).fetchall()
+        timings.append((time.perf_counter() - t0) * 1000)
+    return timings
+
+
+def report(label, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print('  %-14s p50 %9.2f ms   p95 %9.2f ms' % (label, statistics.median(timings), p95))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000000, 10000000])
+    parser.add_argument('--series', type=int, default=9)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+        conn = sqlite3.connect(path)
+        start, end = seed(conn, rows, args.series)
+        print('%d filas, %d series' % (rows, args.series))
+        report('sin indice', measure(conn, start, end, args.series, args.repeat))
+        conn.execute('CREATE INDEX %s ON data (assignedmeasure_id, data_time_measure)' % INDEX_NAME)
+        report('con indice', measure(conn, start, end, args.series, args.repeat))
+        conn.close()
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""optional monthly range partitioning of data (PostgreSQL)
+
+Revision ID: e5b8a2f3c917
+Revises: d4a7c1e95f28
+Create Date: 2026-10-18 16:20:09.771532
+
+Solo se aplica en PostgreSQL 11+ y si DATA_PARTITIONING=1 al correr la migración;
+en el resto de los casos no hace nada y data queda como una tabla común.
+"""
+import datetime
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b8a2f3c917'
+down_revision = 'd4a7c1e95f28'
+branch_labels = None
+depends_on = None
+
+MONTHS_AHEAD = 3
+
+
+def enabled():
+    return op.get_bind().dialect.name == 'postgresql' and os.environ.get('DATA_PARTITIONING') == '1'
+
+
+def is_partitioned():
+    return op.get_bind().execute(sa.text("SELECT relkind FROM pg_class WHERE oid = 'data'::regclass")).scalar() == 'p'
+
+
+def next_month(date):
+    return datetime.datetime(date.year + date.month // 12, date.month % 12 + 1, 1)
+
+
+def upgrade():
+    if not enabled():
+        return
+    bind = op.get_bind()
+    op.execute('ALTER TABLE data RENAME TO data_unpartitioned')
+    op.execute('ALTER INDEX ix_data_assignedmeasure_id_data_time_measure RENAME TO ix_data_unpartitioned_assignedmeasure_id_data_time_measure')
+    # La clave primaria de una tabla particionada tiene que incluir la columna de partición
+    op.execute("""
+        CREATE TABLE data (
+            id integer NOT NULL DEFAULT nextval('data_id_seq'),
+            data_value double precision NOT NULL,
+            data_time_measure timestamp without time zone NOT NULL,
+            assignedmeasure_id integer REFERENCES assignedmeasure (id),
+            PRIMARY KEY (id, data_time_measure)
+        ) PARTITION BY RANGE (data_time_measure)
+    """)
+    op.execute('CREATE INDEX ix_data_assignedmeasure_id_data_time_measure ON data (assignedmeasure_id, data_time_measure)')
+
+    oldest, newest = bind.execute(sa.text('SELECT min(data_time_measure), max(data_time_measure) FROM data_unpartitioned')).first()
+    now = datetime.datetime.utcnow()
+    start = datetime.datetime((oldest or now).year, (oldest or now).month, 1)
+    end = max(newest or now, now)
+    for _ in range(MONTHS_AHEAD):
+        end = next_month(end)
+    while start <= end:
+        op.execute("CREATE TABLE data_%04d_%02d PARTITION OF data FOR VALUES FROM ('%s') TO ('%s')"
+                   % (start.year, start.month, start.isoformat(), next_month(start).isoformat()))
+        start = next_month(start)
+
+    op.execute('INSERT INTO data (id, data_value, data_time_measure, assignedmeasure_id) '
+               'SELECT id, data_value, data_time_measure, assignedmeasure_id FROM data_unpartitioned')
+    op.execute('ALTER SEQUENCE data_id_seq OWNED BY data.id')
+    op.execute('DROP TABLE data_unpartitioned')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql' or not is_partitioned():
+        return
+    op.execute('ALTER TABLE data RENAME TO data_partitioned')
+    op.execute('ALTER INDEX ix_data_assignedmeasure_id_data_time_measure RENAME TO ix_data_partitioned_assignedmeasure_id_data_time_measure')
+    op.create_table('data',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('data_id_seq')"), nullable=False),
+    sa.Column('data_value', sa.Float(), nullable=False),
+    sa.Column('data_time_measure', sa.DateTime(), nullable=False),
+    sa.Column('assignedmeasure_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['assignedmeasure_id'], ['assignedmeasure.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_data_assignedmeasure_id_data_time_measure', 'data', ['assignedmeasure_id', 'data_time_measure'], unique=False)
+    op.execute('INSERT INTO data (id, data_value, data_time_measure, assignedmeasure_id) '
+               'SELECT id, data_value, data_time_measure, assignedmeasure_id FROM data_partitioned')
+    op.execute('ALTER SEQUENCE data_id_seq OWNED BY data.id')
+    op.execute('DROP TABLE data_partitioned')
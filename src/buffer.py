@@ -0,0 +1,194 @@
+"""
+Ingesta diferida (write-behind): las lecturas validadas se encolan en memoria y un hilo las
+inserta en lotes, cuando se junta BUFFER_BATCH_SIZE o cada BUFFER_FLUSH_INTERVAL segundos.
+La cola es acotada (el endpoint responde 429 si está llena) y se vacía al apagar el worker.
+Un lote que falla vuelve al frente de la cola y se reintenta con espera exponencial
+(BUFFER_RETRY_BACKOFF, 2x, 4x... hasta BUFFER_RETRY_MAX_BACKOFF) sin descartarse: mientras
+la base no responde la cola se llena y el endpoint aplica contrapresión. Si después de
+BUFFER_MAX_RETRIES intentos la base sigue rechazando las filas (IntegrityError, DataError),
+el lote se aparta en BUFFER_DEAD_LETTER_PATH como NDJSON, que se puede reenviar a /data/batch.
+"""
+import atexit
+import collections
+import json
+import logging
+import threading
+import time
+
+from sqlalchemy.exc import DataError, IntegrityError
+
+from models import db
+from ingest import insert_readings
+
+logger = logging.getLogger(__name__)
+
+# Errores de los datos: reintentar no sirve, el lote se aparta
+REJECTED_ERRORS = (IntegrityError, DataError)
+
+
+class WriteBehindBuffer:
+    def __init__(self, app):
+        self.app = app
+        self.readings = collections.deque()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopping = False
+        self.inflight = 0
+        self.queued = 0
+        self.flushed = 0
+        self.retries = 0
+        self.attempts = 0
+        self.dead_lettered = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def put(self, rows):
+        """
+        Encola las filas completas o ninguna; devuelve False si no entran (contrapresión).
+        El lote que se está insertando cuenta, así al reencolarlo no se pasa el límite.
+        """
+        with self.condition:
+            if self.stopping or len(self.readings) + self.inflight + len(rows) > self.app.config['BUFFER_MAX_READINGS']:
+                self.rejected += len(rows)
+                return False
+            self.readings.extend(rows)
+            self.queued += len(rows)
+            if len(self.readings) >= self.app.config['BUFFER_BATCH_SIZE']:
+                self.condition.notify()
+            # El hilo se crea con la primera lectura, ya dentro del worker (después del fork)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='write-behind-flusher', daemon=True)
+                self.thread.start()
+                atexit.register(self.stop)
+        return True
+
+    def take(self):
+        with self.condition:
+            size = min(len(self.readings), self.app.config['BUFFER_BATCH_SIZE'])
+            self.inflight = size
+            return [self.readings.popleft() for _ in range(size)]
+
+    def done(self):
+        with self.condition:
+            self.inflight = 0
+
+    def requeue(self, rows):
+        """
+        Devuelve el lote al frente de la cola, en el mismo orden. Entra siempre: put reservó su lugar
+        """
+        with self.condition:
+            self.readings.extendleft(reversed(rows))
+            self.inflight = 0
+
+    def flush(self, rows):
+        """
+        Inserta el lote; devuelve la excepción si falló, None si no
+        """
+        started = time.perf_counter()
+        error = None
+        with self.app.app_context():
+            try:
+                insert_readings(rows)
+                db.session.commit()
+                self.flushed += len(rows)
+            except Exception as e:
+                db.session.rollback()
+                error = e
+                logger.exception('write-behind flush of %d readings failed (attempt %d)', len(rows), self.attempts + 1)
+            finally:
+                db.session.remove()
+        elapsed = time.perf_counter() - started
+        self.flushes += 1
+        self.flush_seconds += elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        return error
+
+    def dead_letter(self, rows):
+        """
+        Agrega el lote al archivo de descarte, una lectura por línea en el formato de /data/batch.
+        Devuelve False si no se pudo escribir
+        """
+        path = self.app.config['BUFFER_DEAD_LETTER_PATH']
+        try:
+            # Con buffer por línea cada lectura se escribe entera aunque varios workers compartan el archivo
+            with open(path, 'a', buffering=1) as f:
+                for row in rows:
+                    f.write(json.dumps({
+                        'assignedmeasure_id': row['assignedmeasure_id'],
+                        'data_time_measure': row['data_time_measure'].isoformat(),
+                        'data_value': row['data_value']
+                    }) + '\n')
+        except OSError:
+            logger.exception('write-behind could not write %d readings to %s', len(rows), path)
+            return False
+        self.dead_lettered += len(rows)
+        logger.error('write-behind set aside %d readings rejected by the database in %s', len(rows), path)
+        return True
+
+    def retry(self, rows, error):
+        """
+        Reencola un lote fallido y espera antes del próximo intento. Pasado BUFFER_MAX_RETRIES,
+        si la base rechaza los datos el lote se aparta; si no (base caída) se sigue reintentando
+        """
+        self.attempts += 1
+        if self.attempts > self.app.config['BUFFER_MAX_RETRIES']:
+            if isinstance(error, REJECTED_ERRORS) and self.dead_letter(rows):
+                self.attempts = 0
+                self.done()
+                return
+            logger.error('write-behind still failing after %d attempts, %d readings kept queued', self.attempts, len(rows))
+        self.retries += 1
+        self.requeue(rows)
+        time.sleep(min(self.app.config['BUFFER_RETRY_BACKOFF'] * 2 ** (self.attempts - 1), self.app.config['BUFFER_RETRY_MAX_BACKOFF']))
+
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.stopping and len(self.readings) < self.app.config['BUFFER_BATCH_SIZE']:
+                    self.condition.wait(self.app.config['BUFFER_FLUSH_INTERVAL'])
+                if self.stopping and not self.readings:
+                    return
+            # Junta todo lo pendiente en lotes de BUFFER_BATCH_SIZE
+            rows = self.take()
+            while rows:
+                error = self.flush(rows)
+                if error is None:
+                    self.attempts = 0
+                    self.done()
+                else:
+                    self.retry(rows, error)
+                rows = self.take()
+
+    def stop(self, timeout=30):
+        """
+        Deja de aceptar lecturas y espera a que se inserte lo pendiente
+        """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        with self.condition:
+            pending = len(self.readings) + self.inflight
+        if pending:
+            logger.error('write-behind stopped with %d readings not inserted', pending)
+
+    def stats(self):
+        with self.condition:
+            depth = len(self.readings)
+            inflight = self.inflight
+        return {
+            "depth": depth,
+            "inflight": inflight,
+            "max_readings": self.app.config['BUFFER_MAX_READINGS'],
+            "queued": self.queued,
+            "flushed": self.flushed,
+            "retries": self.retries,
+            "dead_lettered": self.dead_lettered,
+            "rejected": self.rejected,
+            "flushes": self.flushes,
+            "avg_flush_seconds": self.flush_seconds / self.flushes if self.flushes else None,
+            "max_flush_seconds": self.max_flush_seconds
+        }
@@ -0,0 +1,129 @@
+"""
+Caché en memoria (LRU con TTL) para datos casi estáticos: estaciones, medidas y el mapa
+(station_id, measure_id) -> assignedmeasure_id. Los handlers que escriben invalidan después
+del commit. Las entradas de estaciones y medidas llevan en la clave la versión de la tabla
+(tableversion), así ningún worker sirve un cuerpo viejo con el ETag nuevo; el mapa de
+asignaciones no se sirve con ETag y en los demás workers se actualiza cuando vence el TTL.
+"""
+import collections
+import threading
+import time
+
+from models import db, Assignedmeasure, Measure, Station
+from versions import table_version
+
+MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, name, maxsize=1024, ttl=60):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.items = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, loader):
+        """
+        Devuelve el valor guardado para key o lo carga con loader() y lo guarda (también None)
+        """
+        now = time.monotonic()
+        with self.lock:
+            value, expires = self.items.get(key, (MISSING, 0))
+            if value is not MISSING and expires > now:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        value = loader()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = (value, time.monotonic() + self.ttl)
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def invalidate(self):
+        with self.lock:
+            self.items.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "name": self.name,
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.items),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl
+            }
+
+
+caches = {
+    'station': LRUCache('station'),
+    'measure': LRUCache('measure'),
+    'assignedmeasure': LRUCache('assignedmeasure')
+}
+
+
+def configure_caches(maxsize, ttl):
+    for cache in caches.values():
+        cache.maxsize = maxsize
+        cache.ttl = ttl
+        cache.invalidate()
+
+
+def invalidate_cache(*names):
+    for name in names:
+        caches[name].invalidate()
+
+
+def cache_stats():
+    return [cache.stats() for cache in caches.values()]
+
+
+def assignment_id(station_id, measure_id):
+    """
+    id de la medición asignada a (station_id, measure_id) o None si no existe
+    """
+    def load():
+        row = db.session.query(Assignedmeasure.id).filter(Assignedmeasure.station_id == station_id).filter(Assignedmeasure.measure_id == measure_id).first()
+        return row.id if row is not None else None
+    return caches['assignedmeasure'].get((station_id, measure_id), load)
+
+
+def prefill_assignments():
+    """
+    Carga el mapa (station_id, measure_id) -> assignedmeasure_id completo con una sola consulta
+    """
+    rows = db.session.query(Assignedmeasure.station_id, Assignedmeasure.measure_id, Assignedmeasure.id).limit(caches['assignedmeasure'].maxsize)
+    for row in rows:
+        caches['assignedmeasure'].put((row.station_id, row.measure_id), row.id)
+
+
+def cached_stations():
+    return caches['station'].get(('all', table_version('station')), lambda: [x.serialize() for x in Station.query.all()])
+
+
+def cached_station(station_id):
+    def load():
+        station = Station.query.get(station_id)
+        return station.serialize() if station is not None else None
+    return caches['station'].get((station_id, table_version('station')), load)
+
+
+def cached_measures():
+    return caches['measure'].get(('all', table_version('measure')), lambda: [x.serialize() for x in Measure.query.all()])
+
+
+def cached_measure(measure_id):
+    def load():
+        measure = Measure.query.get(measure_id)
+        return measure.serialize() if measure is not None else None
+    return caches['measure'].get((measure_id, table_version('measure')), load)
@@ -0,0 +1,88 @@
+"""
+Compresión gzip/brotli de las respuestas según Accept-Encoding, solo por encima de un tamaño mínimo.
+Las respuestas por partes (stream) se comprimen bloque a bloque sin juntarlas en memoria.
+"""
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class GzipCompressor:
+    def __init__(self, level):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def process(self, data):
+        # SYNC_FLUSH para que el cliente reciba cada bloque apenas se genera
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliCompressor:
+    def __init__(self, level):
+        self.compressor = brotli.Compressor(quality=min(level, 11))
+
+    def process(self, data):
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+def choose_encoding():
+    encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+    accepted = request.accept_encodings
+    best = accepted.best_match(encodings) if accepted else None
+    return best if best and accepted[best] else None
+
+
+def compress_stream(chunks, compressor):
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compressor.process(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def init_compression(app):
+    """
+    Registra la compresión de respuestas en la app. Configuración: COMPRESS_MIN_SIZE (bytes) y COMPRESS_LEVEL
+    """
+    app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+    app.config.setdefault('COMPRESS_LEVEL', 6)
+
+    @app.after_request
+    def compress_response(response):
+        if response.status_code < 200 or response.status_code in (204, 304) or response.direct_passthrough \
+                or 'Content-Encoding' in response.headers or request.method == 'HEAD':
+            return response
+        response.vary.add('Accept-Encoding')
+
+        encoding = choose_encoding()
+        if encoding is None:
+            return response
+        if not response.is_streamed and response.content_length is not None and response.content_length < app.config['COMPRESS_MIN_SIZE']:
+            return response
+
+        level = app.config['COMPRESS_LEVEL']
+        compressor = BrotliCompressor(level) if encoding == 'br' else GzipCompressor(level)
+        if response.is_streamed:
+            response.response = compress_stream(response.response, compressor)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(compressor.process(response.get_data()) + compressor.finish())
+
+        response.headers['Content-Encoding'] = encoding
+        # El cuerpo comprimido ya no es idéntico byte a byte: el ETag pasa a ser débil
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,86 @@
+"""
+Expansión de relaciones con ?expand=, por ejemplo /organizations?expand=persons.stations.assignedMeasures.
+Cada nivel se carga con una consulta (selectinload para listas, joinedload para muchos a uno),
+no una por fila. Las listas expandidas siempre se paginan; EXPAND_MAX_DEPTH limita la profundidad y
+EXPAND_MAX_ITEMS los objetos de la respuesta.
+"""
+from flask import current_app, request
+from sqlalchemy.orm import joinedload, selectinload
+
+from utils import APIException, paginate, wants_stream
+from models import Assignedmeasure, Organization, Person, Station
+
+RELATIONSHIPS = {
+    Organization: {'persons': Organization.persons},
+    Person: {'stations': Person.stations},
+    Station: {'assignedMeasures': Station.assignedMeasures},
+    Assignedmeasure: {'measure': Assignedmeasure.measure},
+}
+
+
+def expand_arg(model):
+    """
+    Árbol {relación: {subrelación: ...}} pedido en ?expand= (rutas separadas por coma), {} si no hay
+    """
+    tree = {}
+    for path in filter(None, request.args.get('expand', '').split(',')):
+        names = path.strip().split('.')
+        if len(names) > current_app.config.get('EXPAND_MAX_DEPTH', 4):
+            raise APIException('expand can be at most %d levels deep' % current_app.config.get('EXPAND_MAX_DEPTH', 4), status_code=400)
+        current, node = model, tree
+        for name in names:
+            relationship = RELATIONSHIPS.get(current, {}).get(name)
+            if relationship is None:
+                raise APIException('Unknown relationship %s, available: %s' % (name, ', '.join(RELATIONSHIPS.get(current, {})) or 'none'), status_code=400)
+            node = node.setdefault(name, {})
+            current = relationship.property.mapper.class_
+    if tree and wants_stream():
+        raise APIException('expand can not be combined with stream, use limit instead', status_code=400)
+    return tree
+
+
+def expand_options(model, tree, parent=None):
+    """
+    Opciones de carga para el árbol: una consulta más por cada nivel de listas
+    """
+    options = []
+    for name, subtree in tree.items():
+        relationship = RELATIONSHIPS[model][name]
+        loader = selectinload if relationship.property.uselist else joinedload
+        # Las subrelaciones se encadenan sobre la opción del nivel anterior
+        option = getattr(parent, loader.__name__)(relationship) if parent is not None else loader(relationship)
+        options.append(option)
+        options.extend(expand_options(relationship.property.mapper.class_, subtree, option))
+    return options
+
+
+def expanded_serializer(tree):
+    """
+    serialize() con las relaciones del árbol anidadas; corta con 400 si se pasan EXPAND_MAX_ITEMS objetos
+    """
+    max_items = current_app.config.get('EXPAND_MAX_ITEMS', 10000)
+    count = [0]
+
+    def serialize(item, node=tree):
+        count[0] += 1
+        if count[0] > max_items:
+            raise APIException('Expanded response exceeds %d objects, use limit or a shorter expand' % max_items, status_code=400)
+        result = item.serialize()
+        for name, subtree in node.items():
+            value = getattr(item, name)
+            if isinstance(value, list):
+                result[name] = [serialize(x, subtree) for x in value]
+            else:
+                result[name] = serialize(value, subtree) if value is not None else None
+        return result
+
+    return serialize
+
+
+def expanded_response(query, model, tree):
+    """
+    Lista expandida, siempre paginada con ?limit=/?after= (PAGE_DEFAULT_LIMIT si no se indica)
+    para no cargar la tabla entera con sus relaciones antes de poder cortar por EXPAND_MAX_ITEMS
+    """
+    query = query.options(*expand_options(model, tree))
+    return paginate(query, [model.id], serialize=expanded_serializer(tree))
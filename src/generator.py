@@ -0,0 +1,116 @@
+"""
+Generador de series sintéticas para la tabla data (pruebas de carga y planificación de capacidad)
+"""
+import datetime
+import math
+import random
+
+from utils import APIException, parse_datetime
+from models import db, Assignedmeasure
+from ingest import DEFAULT_CHUNK_SIZE, insert_readings
+
+WAVEFORMS = ('random', 'sin', 'cos', 'sincos', 'mix')
+DEFAULT_DATE_FROM = datetime.datetime(2018, 1, 1)
+DEFAULT_DATE_TO = datetime.datetime(2019, 1, 1)
+DEFAULT_INTERVAL = 3600
+
+
+def build_values(waveform, first, count, amplitude, offset, noise, frequency, rng):
+    """
+    Calcula una columna de count valores de la forma de onda a partir de la muestra first
+    """
+    xs = [(first + k) * frequency for k in range(count)]
+    if waveform == 'random':
+        values = [offset + amplitude * rng.uniform(-1, 1) for _ in xs]
+    elif waveform == 'sin':
+        values = [offset + amplitude * math.sin(x) for x in xs]
+    elif waveform == 'cos':
+        values = [offset + amplitude * math.cos(x) for x in xs]
+    elif waveform == 'sincos':
+        values = [offset + amplitude * (math.sin(x) + math.cos(x)) / 2 for x in xs]
+    else:
+        values = [offset + amplitude * math.sin(x) for x in xs]
+        noise = noise or amplitude / 2
+    if noise:
+        values = [v + noise * rng.uniform(-1, 1) for v in values]
+    return values
+
+
+def generate_readings(assignedmeasure_id, date_from, date_to, interval, waveform, amplitude=100.0, offset=0.0, noise=0.0, frequency=1.0, rng=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Genera las filas de una serie en bloques de chunk_size entre date_from (incluida) y date_to (excluida)
+    """
+    rng = rng or random.Random()
+    step = datetime.timedelta(seconds=interval)
+    total = int((date_to - date_from).total_seconds() // interval)
+    for first in range(0, total, chunk_size):
+        count = min(chunk_size, total - first)
+        times = [date_from + step * (first + k) for k in range(count)]
+        values = build_values(waveform, first, count, amplitude, offset, noise, frequency, rng)
+        yield [
+            {'assignedmeasure_id': assignedmeasure_id, 'data_time_measure': t, 'data_value': v}
+            for t, v in zip(times, values)
+        ]
+
+
+def number_option(options, name, default, positive=False):
+    """
+    Valor numérico de options[name] (no se aceptan booleanos); positive exige que sea mayor que cero
+    """
+    value = options.get(name, default)
+    if not isinstance(value, (int, float)) or isinstance(value, bool) or (positive and value <= 0):
+        raise APIException('%s must be a %snumber' % (name, 'positive ' if positive else ''), status_code=400)
+    return value
+
+
+def fill_series(options, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Llena las series indicadas en options y devuelve la cantidad de filas insertadas.
+    Cada bloque se confirma por separado para no mantener una transacción enorme abierta.
+
+    options: series (cantidad) o assignedmeasure_ids, date_from, date_to, interval (segundos),
+    waveform, amplitude, offset, noise, frequency, seed
+    """
+    date_from = parse_datetime(options.get('date_from', DEFAULT_DATE_FROM))
+    date_to = parse_datetime(options.get('date_to', DEFAULT_DATE_TO))
+    if date_from is None or date_to is None:
+        raise APIException('date_from and date_to must be ISO 8601 dates', status_code=400)
+    if date_to <= date_from:
+        raise APIException('date_to must be after date_from', status_code=400)
+    interval = number_option(options, 'interval', DEFAULT_INTERVAL, positive=True)
+    amplitude = number_option(options, 'amplitude', 100.0)
+    offset = number_option(options, 'offset', 0.0)
+    noise = number_option(options, 'noise', 0.0)
+    frequency = number_option(options, 'frequency', 1.0)
+    seed = options.get('seed')
+    if seed is not None and (not isinstance(seed, (int, str)) or isinstance(seed, bool)):
+        raise APIException('seed must be an integer or a string', status_code=400)
+    waveform = options.get('waveform')
+    if waveform is not None and waveform not in WAVEFORMS:
+        raise APIException('waveform must be one of %s' % ', '.join(WAVEFORMS), status_code=400)
+
+    query = db.session.query(Assignedmeasure.id).order_by(Assignedmeasure.id)
+    if 'assignedmeasure_ids' in options:
+        if not isinstance(options['assignedmeasure_ids'], list):
+            raise APIException('assignedmeasure_ids must be a list', status_code=400)
+        query = query.filter(Assignedmeasure.id.in_(options['assignedmeasure_ids']))
+    elif 'series' in options:
+        if not isinstance(options['series'], int) or isinstance(options['series'], bool) or options['series'] <= 0:
+            raise APIException('series must be a positive integer', status_code=400)
+        query = query.limit(options['series'])
+    assignedmeasure_ids = [x.id for x in query]
+    if not assignedmeasure_ids:
+        raise APIException('Assigned measures not found', status_code=404)
+
+    rng = random.Random(seed)
+    inserted = 0
+    for index, assignedmeasure_id in enumerate(assignedmeasure_ids):
+        # Sin forma de onda explícita se alternan todas para tener series variadas
+        serie_waveform = waveform or WAVEFORMS[index % len(WAVEFORMS)]
+        for rows in generate_readings(assignedmeasure_id, date_from, date_to, interval, serie_waveform,
+                                      amplitude=amplitude, offset=offset, noise=noise, frequency=frequency,
+                                      rng=rng, chunk_size=chunk_size):
+            insert_readings(rows)
+            db.session.commit()
+            inserted += len(rows)
+    return inserted
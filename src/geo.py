@@ -0,0 +1,106 @@
+"""
+Índice espacial en memoria de las estaciones: una grilla de celdas de GEO_CELL_DEGREES grados
+con (lat, lon, id) en cada celda. Se guarda en la caché de estaciones con la versión de la
+tabla en la clave, así que se reconstruye después de cualquier escritura en cualquier worker.
+"""
+import heapq
+import math
+
+from flask import current_app
+
+from models import db, Station
+from cache import caches
+from versions import table_version
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex:
+    def __init__(self, points, cell_degrees):
+        self.cell = cell_degrees
+        self.size = 0
+        self.cells = {}
+        for lat, lon, station_id in points:
+            self.cells.setdefault(self.key(lat, lon), []).append((lat, lon, station_id))
+            self.size += 1
+
+    def key(self, lat, lon):
+        return int(math.floor(lat / self.cell)), int(math.floor(lon / self.cell))
+
+    def candidates(self, min_lat, min_lon, max_lat, max_lon):
+        """
+        Puntos de las celdas que tocan la caja; si la caja abarca más celdas que puntos se recorre todo
+        """
+        (y0, x0), (y1, x1) = self.key(min_lat, min_lon), self.key(max_lat, max_lon)
+        if (y1 - y0 + 1) * (x1 - x0 + 1) > len(self.cells):
+            for points in self.cells.values():
+                yield from points
+            return
+        for y in range(y0, y1 + 1):
+            for x in range(x0, x1 + 1):
+                yield from self.cells.get((y, x), ())
+
+    def within(self, min_lat, min_lon, max_lat, max_lon):
+        """
+        ids dentro de la caja. Con min_lon > max_lon la caja cruza el antimeridiano
+        """
+        if min_lon > max_lon:
+            return self.within(min_lat, min_lon, max_lat, 180) + self.within(min_lat, -180, max_lat, max_lon)
+        return [
+            station_id for lat, lon, station_id in self.candidates(min_lat, min_lon, max_lat, max_lon)
+            if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon
+        ]
+
+    def nearest(self, lat, lon, k):
+        """
+        Los k más cercanos como [(distancia_km, id)]. Primero se agranda un anillo de celdas hasta juntar
+        k candidatos; su k-ésima distancia define un círculo que seguro contiene a los k más cercanos,
+        y se buscan dentro de la caja que lo encierra.
+        """
+        k = min(k, self.size)
+        if k == 0:
+            return []
+        cy, cx = self.key(lat, lon)
+        found = []
+        ring = 0
+        while len(found) < k:
+            # Con más celdas en el cuadrado que celdas ocupadas conviene tomar todos los puntos
+            if (2 * ring + 1) ** 2 > len(self.cells):
+                found = list(self.candidates(-90, -180, 90, 180))
+                break
+            for y in range(cy - ring, cy + ring + 1):
+                step = 1 if abs(y - cy) == ring else 2 * ring
+                for x in range(cx - ring, cx + ring + 1, step or 1):
+                    found.extend(self.cells.get((y, x), ()))
+            ring += 1
+        radius = heapq.nsmallest(k, (haversine_km(lat, lon, plat, plon) for plat, plon, _ in found))[-1]
+
+        dlat = radius / KM_PER_DEGREE
+        min_lat, max_lat = lat - dlat, lat + dlat
+        cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+        if max_lat >= 90 or min_lat <= -90 or dlat / max(cos_lat, 1e-12) >= 180:
+            points = self.candidates(-90, -180, 90, 180)
+        else:
+            dlon = dlat / cos_lat
+            min_lon, max_lon = lon - dlon, lon + dlon
+            points = list(self.candidates(min_lat, max(min_lon, -180), max_lat, min(max_lon, 180)))
+            if min_lon < -180:
+                points += list(self.candidates(min_lat, min_lon + 360, max_lat, 180))
+            if max_lon > 180:
+                points += list(self.candidates(min_lat, -180, max_lat, max_lon - 360))
+        distances = {station_id: haversine_km(lat, lon, plat, plon) for plat, plon, station_id in points}
+        return heapq.nsmallest(k, ((d, station_id) for station_id, d in distances.items()))
+
+
+def station_index():
+    def load():
+        rows = db.session.query(Station.lat, Station.lon, Station.id).filter(Station.lat.isnot(None)).filter(Station.lon.isnot(None))
+        return GridIndex(((row.lat, row.lon, row.id) for row in rows), current_app.config.get('GEO_CELL_DEGREES', 1.0))
+    return caches['station'].get(('grid', table_version('station')), load)
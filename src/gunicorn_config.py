@@ -0,0 +1,11 @@
+# Configuración de gunicorn (Procfile). Con GUNICORN_PRELOAD=1 la app se importa y se calienta
+# una vez en el proceso principal y los workers la heredan ya lista.
+import os
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+
+def post_fork(server, worker):
+    from wsgi import application
+    from warmup import after_fork
+    after_fork(application)
@@ -0,0 +1,135 @@
+"""
+Ingesta masiva de mediciones (tabla data): validación por lotes e inserción en bloques
+"""
+import csv
+import io
+import itertools
+import json
+import math
+import numbers
+
+from flask import current_app
+
+from utils import APIException, parse_datetime
+from models import db, Assignedmeasure, Data
+from rollups import update_rollups
+from partitions import ensure_partitions
+
+DEFAULT_CHUNK_SIZE = 5000
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+
+def iter_request_records(request):
+    """
+    Recorre las lecturas del cuerpo: un array JSON o un flujo NDJSON (una lectura por línea)
+    """
+    if request.mimetype in NDJSON_MIMETYPES:
+        for number, line in enumerate(request.stream):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                raise APIException('Invalid JSON in line %d' % (number + 1), status_code=400)
+        return
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, list):
+        raise APIException("You need to specify the request body as a json array or ndjson stream", status_code=400)
+    for record in body:
+        yield record
+
+
+def validate_readings(records, offset, known_ids):
+    """
+    Valida un bloque de lecturas y devuelve las filas listas para insertar.
+    known_ids guarda los assignedmeasure_id ya comprobados entre bloques.
+    """
+    rows = []
+    for index, record in enumerate(records, offset):
+        if not isinstance(record, dict):
+            raise APIException('Reading must be a json object', status_code=400, payload={'index': index})
+        for key in ('assignedmeasure_id', 'data_time_measure', 'data_value'):
+            if key not in record:
+                raise APIException('You need to specify the %s' % key, status_code=400, payload={'index': index})
+        assignedmeasure_id = record['assignedmeasure_id']
+        value = record['data_value']
+        if not isinstance(assignedmeasure_id, int) or isinstance(assignedmeasure_id, bool):
+            raise APIException('assignedmeasure_id must be an integer', status_code=400, payload={'index': index})
+        if not isinstance(value, numbers.Real) or isinstance(value, bool):
+            raise APIException('data_value must be a number', status_code=400, payload={'index': index})
+        # json acepta NaN e Infinity, y un entero enorme no entra en un float
+        try:
+            value = float(value)
+        except OverflowError:
+            value = math.inf
+        if not math.isfinite(value):
+            raise APIException('data_value must be a finite number', status_code=400, payload={'index': index})
+        date = parse_datetime(record['data_time_measure'])
+        if date is None:
+            raise APIException('data_time_measure must be an ISO 8601 date', status_code=400, payload={'index': index})
+        rows.append({'assignedmeasure_id': assignedmeasure_id, 'data_time_measure': date, 'data_value': value})
+
+    # Una sola consulta por bloque para comprobar que las series existen
+    pending = {row['assignedmeasure_id'] for row in rows} - known_ids
+    if pending:
+        found = {x.id for x in db.session.query(Assignedmeasure.id).filter(Assignedmeasure.id.in_(pending))}
+        missing = pending - found
+        if missing:
+            raise APIException('Assigned measure not found', status_code=404, payload={'assignedmeasure_id': sorted(missing)})
+        known_ids.update(found)
+    return rows
+
+
+def copy_readings(rows):
+    """
+    Inserta un bloque con COPY ... FROM STDIN (solo PostgreSQL) dentro de la transacción de la sesión
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow((row['data_value'], row['data_time_measure'].isoformat(), row['assignedmeasure_id']))
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert('COPY data (data_value, data_time_measure, assignedmeasure_id) FROM STDIN WITH CSV', buffer)
+    finally:
+        cursor.close()
+
+
+def insert_readings(rows):
+    """
+    Inserta un bloque de filas ya validadas con una sola sentencia multi-fila (executemany)
+    y actualiza los agregados por hora y día en la misma transacción
+    """
+    ensure_partitions([row['data_time_measure'] for row in rows])
+    if db.session.get_bind().dialect.name == 'postgresql':
+        copy_readings(rows)
+    else:
+        db.session.execute(Data.__table__.insert(), rows)
+    if current_app.config.get('USE_ROLLUPS', True):
+        update_rollups(rows)
+
+
+def ingest_readings(records, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Valida e inserta las lecturas en bloques de chunk_size en una única transacción.
+    Si alguna lectura es inválida no se guarda ninguna. Devuelve la cantidad insertada.
+    """
+    records = iter(records)
+    known_ids = set()
+    inserted = 0
+    try:
+        while True:
+            chunk = list(itertools.islice(records, chunk_size))
+            if not chunk:
+                break
+            rows = validate_readings(chunk, inserted, known_ids)
+            insert_readings(rows)
+            inserted += len(rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return inserted
@@ -2,22 +2,83 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import datetime
-import os, random, math
-from flask import Flask, request, jsonify, url_for
+import itertools
+import math
+import os
+import time
+import click
+from flask import Flask, request, jsonify
 from flask_migrate import Migrate
-from flask_swagger import swagger
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
-from models import db, Person, Organization, Measure, Assignedmeasure, Data, Station
-from sqlalchemy import func
+from compression import init_compression
+from expand import expand_arg, expand_options, expanded_response, expanded_serializer
+from geo import station_index
+from routing import REPLICA_BIND, init_routing
+from metrics import init_metrics, render_metrics, timed_serialize
+from utils import APIException, encode, epoch_ms, generate_sitemap, paginate, parse_coordinate, parse_datetime, response_mimetypes, rows_response, series_response, stream_json, wants_columns, wants_page, wants_stream
+from models import db, Person, Organization, Measure, Assignedmeasure, Data, Station, Retentionpolicy
+from ingest import ingest_readings, iter_request_records, validate_readings
+from buffer import WriteBehindBuffer
+from generator import WAVEFORMS, fill_series
+from versions import bump_version, versioned
+from cache import assignment_id, cache_stats, cached_measure, cached_measures, cached_station, cached_stations, configure_caches, invalidate_cache
+from export import export_mimetypes, export_range, fetch_columns
+from partitions import create_future_partitions, drop_partitions
+from retention import POLICY_FIELDS, compact, storage_report
+from rollups import BUCKET_RESOLUTION, multi_range_rollup_buckets, multi_rollup_buckets, rebuild_rollups, rollup_buckets
+from timeseries import BUCKET_FIELDS, BUCKETS, aggregate_buckets, auto_bucket, bucket_values, downsample, latest_values, multi_range_values, range_query, resolve_series, truncate
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 
 app = Flask(__name__)
 app.url_map.strict_slashes = False
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DB_CONNECTION_STRING')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1',
+    'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800))
+}
+#Tamaño del pool solo si se configura: SQLite en memoria usa un pool que no los acepta
+for option in ('pool_size', 'max_overflow', 'pool_timeout'):
+    if 'DB_' + option.upper() in os.environ:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'][option] = int(os.environ['DB_' + option.upper()])
+if os.environ.get('REPLICA_DB_CONNECTION_STRING'):
+    app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: os.environ['REPLICA_DB_CONNECTION_STRING']}
+app.config['REPLICA_STICKY_SECONDS'] = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+app.config['DATA_BATCH_CHUNK_SIZE'] = int(os.environ.get('DATA_BATCH_CHUNK_SIZE', 5000))
+app.config['STREAM_CHUNK_SIZE'] = int(os.environ.get('STREAM_CHUNK_SIZE', 1000))
+app.config['PAGE_DEFAULT_LIMIT'] = int(os.environ.get('PAGE_DEFAULT_LIMIT', 100))
+app.config['PAGE_MAX_LIMIT'] = int(os.environ.get('PAGE_MAX_LIMIT', 1000))
+app.config['USE_ROLLUPS'] = os.environ.get('USE_ROLLUPS', '1') == '1'
+app.config['AUTO_BUCKET_POINTS'] = int(os.environ.get('AUTO_BUCKET_POINTS', 1000))
+app.config['DATA_QUERY_MAX_SERIES'] = int(os.environ.get('DATA_QUERY_MAX_SERIES', 100))
+app.config['BUFFER_MAX_READINGS'] = int(os.environ.get('BUFFER_MAX_READINGS', 100000))
+app.config['BUFFER_BATCH_SIZE'] = int(os.environ.get('BUFFER_BATCH_SIZE', 5000))
+app.config['BUFFER_FLUSH_INTERVAL'] = float(os.environ.get('BUFFER_FLUSH_INTERVAL', 1.0))
+app.config['BUFFER_MAX_RETRIES'] = int(os.environ.get('BUFFER_MAX_RETRIES', 5))
+app.config['BUFFER_RETRY_BACKOFF'] = float(os.environ.get('BUFFER_RETRY_BACKOFF', 0.5))
+app.config['BUFFER_RETRY_MAX_BACKOFF'] = float(os.environ.get('BUFFER_RETRY_MAX_BACKOFF', 30))
+app.config['BUFFER_DEAD_LETTER_PATH'] = os.environ.get('BUFFER_DEAD_LETTER_PATH', 'write_behind_dead_letter.ndjson')
+app.config['GEO_CELL_DEGREES'] = float(os.environ.get('GEO_CELL_DEGREES', 1.0))
+app.config['GEO_MAX_RESULTS'] = int(os.environ.get('GEO_MAX_RESULTS', 1000))
+app.config['GEO_MAX_NEAREST'] = int(os.environ.get('GEO_MAX_NEAREST', 100))
+app.config['DASHBOARD_WINDOW_HOURS'] = int(os.environ.get('DASHBOARD_WINDOW_HOURS', 24))
+app.config['DASHBOARD_MAX_HOURS'] = int(os.environ.get('DASHBOARD_MAX_HOURS', 24 * 366))
+app.config['DASHBOARD_SPARKLINE_POINTS'] = int(os.environ.get('DASHBOARD_SPARKLINE_POINTS', 48))
+app.config['EXPAND_MAX_DEPTH'] = int(os.environ.get('EXPAND_MAX_DEPTH', 4))
+app.config['EXPAND_MAX_ITEMS'] = int(os.environ.get('EXPAND_MAX_ITEMS', 10000))
+app.config['CACHE_MAXSIZE'] = int(os.environ.get('CACHE_MAXSIZE', 1024))
+app.config['CACHE_TTL'] = float(os.environ.get('CACHE_TTL', 60))
 MIGRATE = Migrate(app, db)
+configure_caches(app.config['CACHE_MAXSIZE'], app.config['CACHE_TTL'])
 db.init_app(app)
 CORS(app)
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+init_routing(app)
+init_metrics(app)
+init_compression(app)
+write_behind = WriteBehindBuffer(app)
 
 @app.errorhandler(APIException)
 def handle_invalid_usage(error):
@@ -59,9 +120,16 @@ def handle_organization():
 
         # GET request
     if request.method == 'GET':
+        expand = expand_arg(Organization)
+        if expand:
+            return expanded_response(Organization.query, Organization, expand)
+        if wants_page():
+            return paginate(Organization.query, [Organization.id])
+        if wants_stream():
+            return stream_json(Organization.query)
         all_organization = Organization.query.all()
         all_organization = list(map(lambda x: x.serialize(), all_organization))
-        return jsonify(all_organization), 200
+        return rows_response(all_organization), 200
 
     return "Invalid Method", 404
 
@@ -74,9 +142,14 @@ def handle_organization_people(organization_id):
 
         # GET request
     if request.method == 'GET':
-        organization_people = Person.query.filter(organization_id=organization_id)
+        organization_people = Person.query.filter_by(organization_id=organization_id)
+        expand = expand_arg(Person)
+        if expand:
+            return expanded_response(organization_people, Person, expand)
+        if wants_stream():
+            return stream_json(organization_people)
         organization_people = list(map(lambda x: x.serialize(), organization_people))
-        return jsonify(organization_people), 200
+        return rows_response(organization_people), 200
 
     return "Invalid Method", 404
 
@@ -110,9 +183,16 @@ def handle_person():
 
         # GET request
     if request.method == 'GET':
+        expand = expand_arg(Person)
+        if expand:
+            return expanded_response(Person.query, Person, expand)
+        if wants_page():
+            return paginate(Person.query, [Person.id])
+        if wants_stream():
+            return stream_json(Person.query)
         all_people = Person.query.all()
         all_people = list(map(lambda x: x.serialize(), all_people))
-        return jsonify(all_people), 200
+        return rows_response(all_people), 200
 
     return "Invalid Method", 404
 
@@ -121,6 +201,7 @@ def handle_person():
 
 
 @app.route('/stations', methods=['POST', 'GET'])
+@versioned('station')
 def handle_station():
     """
     Trae lista de estaciones (GET) y agrega una estación (POST)
@@ -149,18 +230,27 @@ def handle_station():
 
         station1 = Station(name=body['name'], lattitude=body['lattitude'], longitude=body['longitude'], person_id=body['person_id'], description=body['description'], organization_id=body['organization_id'], streetaddress=body['streetaddress'], numberaddress=body['numberaddress'])
         db.session.add(station1)
+        bump_version('station')
         db.session.commit()
+        invalidate_cache('station')
         return "ok", 200
 
     # GET request
     if request.method == 'GET':
-        all_stations = Station.query.all()
-        all_stations = list(map(lambda x: x.serialize(), all_stations))
-        return jsonify(all_stations), 200
+        expand = expand_arg(Station)
+        if expand:
+            return expanded_response(Station.query, Station, expand)
+        if wants_page():
+            return paginate(Station.query, [Station.id])
+        if wants_stream():
+            return stream_json(Station.query)
+        all_stations = cached_stations()
+        return rows_response(all_stations), 200
 
     return "Invalid Method", 404
 
 @app.route('/stations/<int:station_id>', methods=['PUT', 'DELETE', 'GET'])
+@versioned('station')
 def get_single_station(station_id):
     """
     edita una estación (PUT), borra una estacion (DELETE) y trae una estación (GET)
@@ -193,9 +283,12 @@ def get_single_station(station_id):
         if "numberaddress" in body:
             station1.numberaddress = body["numberaddress"]
 
+        bump_version('station')
         db.session.commit()
 
-        return jsonify(station1.serialize()), 200
+        invalidate_cache('station')
+
+        return encode(station1.serialize()), 200
 
     # DELETE request
     if request.method == 'DELETE':
@@ -203,15 +296,146 @@ def get_single_station(station_id):
         if station1 is None:
             raise APIException('Station not found', status_code=404)
         db.session.delete(station1)
+        bump_version('station')
         db.session.commit()
+        invalidate_cache('station')
         return "ok", 200
 
     # GET request
     if request.method == 'GET':
-        station1 = Station.query.get(station_id)
+        expand = expand_arg(Station)
+        if expand:
+            station1 = Station.query.options(*expand_options(Station, expand)).filter_by(id=station_id).first()
+            if station1 is None:
+                raise APIException('Station not found', status_code=404)
+            return encode(expanded_serializer(expand)(station1)), 200
+        station1 = cached_station(station_id)
+        if station1 is None:
+            raise APIException('Station not found', status_code=404)
+        return encode(station1), 200
+
+    return "Invalid Method", 404
+
+
+def coordinate_arg(name, limit):
+    value = parse_coordinate(request.args.get(name), limit)
+    if value is None:
+        raise APIException('%s must be a number between -%d and %d' % (name, limit, limit), status_code=400)
+    return value
+
+def limit_arg(name, default, maximum):
+    value = request.args.get(name, str(default))
+    if not value.isdigit() or not 0 < int(value) <= maximum:
+        raise APIException('%s must be an integer between 1 and %d' % (name, maximum), status_code=400)
+    return int(value)
+
+def serialize_stations(station_ids):
+    """
+    Estaciones en el orden de station_ids con una consulta; con ?latest=1 suma la última lectura
+    de cada medición asignada con una consulta más
+    """
+    stations = {x.id: x.serialize() for x in Station.query.filter(Station.id.in_(station_ids))} if station_ids else {}
+    if request.args.get('latest', '').lower() in ('1', 'true', 'yes') and stations:
+        for station in stations.values():
+            station['latest'] = []
+        assignedmeasure_ids = [x.id for x in db.session.query(Assignedmeasure.id).filter(Assignedmeasure.station_id.in_(station_ids))]
+        for value in latest_values(assignedmeasure_ids):
+            stations[value['station_id']]['latest'].append(value)
+    return [stations[x] for x in station_ids if x in stations]
+
+@app.route('/stations/bbox', methods=['GET'])
+def get_stations_in_bbox():
+    """
+    Trae las estaciones dentro de una caja min_lat, min_lon, max_lat, max_lon (GET).
+    Con min_lon > max_lon la caja cruza el antimeridiano; ?latest=1 suma las últimas lecturas
+    """
+
+    # GET request
+    if request.method == 'GET':
+        min_lat, max_lat = coordinate_arg('min_lat', 90), coordinate_arg('max_lat', 90)
+        min_lon, max_lon = coordinate_arg('min_lon', 180), coordinate_arg('max_lon', 180)
+        if min_lat > max_lat:
+            raise APIException('min_lat must not be greater than max_lat', status_code=400)
+        limit = limit_arg('limit', app.config['GEO_MAX_RESULTS'], app.config['GEO_MAX_RESULTS'])
+
+        station_ids = sorted(station_index().within(min_lat, min_lon, max_lat, max_lon))
+        response = rows_response(serialize_stations(station_ids[:limit]))
+        response.headers['X-Total-Count'] = str(len(station_ids))
+        return response, 200
+
+    return "Invalid Method", 404
+
+@app.route('/stations/nearest', methods=['GET'])
+def get_nearest_stations():
+    """
+    Trae las k estaciones más cercanas a lat, lon con su distance_km (GET); ?latest=1 suma las últimas lecturas
+    """
+
+    # GET request
+    if request.method == 'GET':
+        lat, lon = coordinate_arg('lat', 90), coordinate_arg('lon', 180)
+        k = limit_arg('k', 10, app.config['GEO_MAX_NEAREST'])
+
+        nearest = station_index().nearest(lat, lon, k)
+        distances = {station_id: distance for distance, station_id in nearest}
+        stations = serialize_stations([station_id for _, station_id in nearest])
+        for station in stations:
+            station['distance_km'] = round(distances[station['id']], 3)
+        return rows_response(stations), 200
+
+    return "Invalid Method", 404
+
+@app.route('/stations/<int:station_id>/dashboard', methods=['GET'])
+def get_station_dashboard(station_id):
+    """
+    Trae la estación, sus mediciones con nombre y unidad, la última lectura de cada una y una
+    serie agregada (sparkline) de las últimas ?hours= horas hasta la lectura más reciente (GET).
+    ?bucket= elige el intervalo (por defecto el más fino que entra en DASHBOARD_SPARKLINE_POINTS).
+    Son cuatro consultas sin importar la cantidad de mediciones.
+    """
+
+    # GET request
+    if request.method == 'GET':
+        hours = limit_arg('hours', app.config['DASHBOARD_WINDOW_HOURS'], app.config['DASHBOARD_MAX_HOURS'])
+        bucket = request.args.get('bucket', 'auto')
+        if bucket != 'auto' and bucket not in BUCKETS:
+            raise APIException('bucket must be one of auto, %s' % ', '.join(BUCKETS), status_code=400)
+
+        #Estación, mediciones asignadas y medidas: una consulta por nivel
+        station1 = Station.query.options(selectinload(Station.assignedMeasures).joinedload(Assignedmeasure.measure)).filter_by(id=station_id).first()
         if station1 is None:
             raise APIException('Station not found', status_code=404)
-        return station1.serialize(), 200
+        assignments = sorted(station1.assignedMeasures, key=lambda x: x.id)
+        assignedmeasure_ids = [x.id for x in assignments]
+
+        latest = {x['id']: x for x in latest_values(assignedmeasure_ids)} if assignedmeasure_ids else {}
+        dates = [x['data_time_measure'] for x in latest.values() if x['data_time_measure'] is not None]
+        window = None
+        sparklines = {}
+        if dates:
+            dateto = max(dates)
+            datefrom = dateto - datetime.timedelta(hours=hours)
+            if bucket == 'auto':
+                bucket = auto_bucket(datefrom, dateto, app.config['DASHBOARD_SPARKLINE_POINTS'])
+            datefrom = truncate(datefrom, bucket)
+            window = {"date_from": datefrom, "date_to": dateto, "bucket": bucket}
+            #Todas las series en una consulta: de los agregados guardados si el intervalo lo permite
+            if app.config['USE_ROLLUPS'] and bucket in BUCKET_RESOLUTION:
+                sparklines = multi_rollup_buckets(assignedmeasure_ids, datefrom, dateto, bucket)
+            else:
+                values = multi_range_values({x: (datefrom, dateto) for x in assignedmeasure_ids})
+                sparklines = {x: aggregate_buckets([(row.data_time_measure, row.data_value) for row in rows], bucket) for x, rows in values.items()}
+
+        measures = []
+        for assignment in assignments:
+            last = latest.get(assignment.id, {})
+            measures.append({
+                "assignedmeasure_id": assignment.id,
+                "measure": assignment.measure.serialize(),
+                "latest": {"data_time_measure": last.get('data_time_measure'), "data_value": last.get('data_value')},
+                "sparkline": sparklines.get(assignment.id, [])
+            })
+        return encode({"station": station1.serialize(), "window": window, "measures": measures}), 200
 
     return "Invalid Method", 404
 
@@ -220,6 +444,7 @@ def get_single_station(station_id):
 
 
 @app.route('/measures', methods=['POST', 'GET'])
+@versioned('measure')
 def handle_measure():
     """
     Trae lista de medida (GET) y agrega una medida (POST)
@@ -240,18 +465,24 @@ def handle_measure():
 
         measure1 = Measure(name=body['name'], unit=body['unit'], symbol=body['symbol'])
         db.session.add(measure1)
+        bump_version('measure')
         db.session.commit()
+        invalidate_cache('measure')
         return "ok", 200
 
     # GET request
     if request.method == 'GET':
-        all_measures = Measure.query.all()
-        all_measures = list(map(lambda x: x.serialize(), all_measures))
-        return jsonify(all_measures), 200
+        if wants_page():
+            return paginate(Measure.query, [Measure.id])
+        if wants_stream():
+            return stream_json(Measure.query)
+        all_measures = cached_measures()
+        return rows_response(all_measures), 200
 
     return "Invalid Method", 404
 
 @app.route('/measures/<int:measure_id>', methods=['PUT', 'DELETE', 'GET'])
+@versioned('measure')
 def get_single_measure(measure_id):
     """
     edita una medida (PUT), borra una medida (DELETE) y trae una medida
@@ -274,9 +505,12 @@ def get_single_measure(measure_id):
         if "symbol" in body:
             measure1.symbol = body["symbol"]
 
+        bump_version('measure')
         db.session.commit()
 
-        return jsonify(measure1.serialize()), 200
+        invalidate_cache('measure')
+
+        return encode(measure1.serialize()), 200
 
     # DELETE request
     if request.method == 'DELETE':
@@ -284,15 +518,17 @@ def get_single_measure(measure_id):
         if measure1 is None:
             raise APIException('Measure not found', status_code=404)
         db.session.delete(measure1)
+        bump_version('measure')
         db.session.commit()
+        invalidate_cache('measure')
         return "ok", 200
 
     # GET request
     if request.method == 'GET':
-        measure1 = Measure.query.get(measure_id)
+        measure1 = cached_measure(measure_id)
         if measure1 is None:
             raise APIException('Measure not found', status_code=404)
-        return measure1.serialize(), 200
+        return encode(measure1), 200
 
 
     return "Invalid Method", 404
@@ -302,6 +538,7 @@ def get_single_measure(measure_id):
 
 
 @app.route('/assignedmeasures', methods=['POST', 'GET'])
+@versioned('assignedmeasure')
 def handle_assigned_measures():
     """
     asigna una medicion a estación (POST)
@@ -320,14 +557,20 @@ def handle_assigned_measures():
 
         assignedmeasure1 = Assignedmeasure(station_id=body['station_id'], measure_id=body['measure_id'])
         db.session.add(assignedmeasure1)
+        bump_version('assignedmeasure')
         db.session.commit()
+        invalidate_cache('assignedmeasure')
         return "ok", 200
 
     # GET request
     if request.method == 'GET':
+        if wants_page():
+            return paginate(Assignedmeasure.query, [Assignedmeasure.id])
+        if wants_stream():
+            return stream_json(Assignedmeasure.query)
         all_assignedmeasures = Assignedmeasure.query.all()
         all_assignedmeasures = list(map(lambda x: x.serialize(), all_assignedmeasures))
-        return jsonify(all_assignedmeasures), 200
+        return rows_response(all_assignedmeasures), 200
 
     return "Invalid Method", 404
 
@@ -348,16 +591,59 @@ def handle_data_measure(station_id, measure_id, date_from, date_to):
         dateto= datetime.datetime(int(e[0:4]), int(e[4:6]), int(e[6:8]), int(e[8:10]), int(e[10:12]), int(e[12:14]))
 
         #Obtengo data con la id requerida
-        datameasure = Assignedmeasure.query.filter(Assignedmeasure.station_id==station_id).filter(Assignedmeasure.measure_id==measure_id).first()
-
-        #Obtengo la data necesaria filtrando por fechas y por la id que obtengo en el filtrado anterior
-        values = Data.query.filter(Data.data_time_measure >= datefrom).filter(Data.data_time_measure <= dateto).filter(Data.assignedmeasure_id == datameasure.id )
+        datameasure_id = assignment_id(station_id, measure_id)
+        if datameasure_id is None:
+            raise APIException('Measure not found', status_code=404)
 
-        if values is None:
-            raise APIException('Values not found', status_code=404)
+        max_points = request.args.get('max_points')
+        if max_points is not None:
+            if not max_points.isdigit() or int(max_points) < 3:
+                raise APIException('max_points must be an integer greater than 2', status_code=400)
+            max_points = int(max_points)
+
+        #Con bucket= devuelvo agregados por intervalo en vez de cada lectura; con bucket=auto
+        #el intervalo más fino que entra en max_points. hour/day/week/month salen de los agregados guardados
+        bucket = request.args.get('bucket')
+        if bucket is not None:
+            if bucket == 'auto':
+                bucket = auto_bucket(datefrom, dateto, max_points or app.config['AUTO_BUCKET_POINTS'])
+            if bucket not in BUCKETS:
+                raise APIException('bucket must be one of auto, %s' % ', '.join(BUCKETS), status_code=400)
+            if app.config['USE_ROLLUPS'] and bucket in BUCKET_RESOLUTION:
+                return series_response(rollup_buckets(datameasure_id, datefrom, dateto, bucket), BUCKET_FIELDS), 200
+            return series_response(bucket_values(datameasure_id, datefrom, dateto, bucket), BUCKET_FIELDS), 200
+
+        #Con max_points= reduzco las lecturas conservando picos y valles (LTTB)
+        if max_points is not None:
+            return series_response(downsample(datameasure_id, datefrom, dateto, max_points)), 200
+
+        #Obtengo la data necesaria filtrando por la id que obtengo en el filtrado anterior y por fechas
+        values = range_query(datameasure_id, datefrom, dateto)
+
+        #Formatos columnares binarios según el header Accept (sin Accept se responde JSON)
+        if request.accept_mimetypes:
+            mimetypes = response_mimetypes() + export_mimetypes()
+            mimetype = request.accept_mimetypes.best_match(mimetypes)
+            if mimetype is None:
+                raise APIException('Not acceptable, available formats: %s' % ', '.join(mimetypes), status_code=406)
+            if mimetype in export_mimetypes():
+                return export_range(values, mimetype)
+
+        #Con ?format=columns devuelvo {"t": [epoch ms], "v": [valores]} en vez de un objeto por lectura,
+        #también por página; por partes no, porque las columnas se arman completas en memoria
+        if wants_page():
+            serialize = (lambda x: {"t": epoch_ms(x.data_time_measure), "v": x.data_value}) if wants_columns() else (lambda x: x.serialize())
+            return paginate(values, [Data.data_time_measure, Data.id], serialize=serialize)
+        if wants_stream():
+            if wants_columns():
+                raise APIException('format=columns can not be combined with stream, use limit instead', status_code=400)
+            return stream_json(values)
+        if wants_columns():
+            times, data_values = fetch_columns(values)
+            return encode({"t": times.tolist(), "v": data_values.tolist()}), 200
 
         parsed_values = list(map(lambda x: x.serialize(), values))
-        return jsonify(parsed_values), 200
+        return rows_response(parsed_values), 200
 
     return "Invalid Method", 404
 
@@ -370,36 +656,8 @@ def handle_last_data_measure():
 
     # GET request
     if request.method == 'GET':
-
-        all_assignedmeasures = Assignedmeasure.query.all()
-        all_assignedmeasures = list(map(lambda x: x.serialize(), all_assignedmeasures))
-        size=len(all_assignedmeasures)
-        lastdata=[]
-        items=[]
-        for i in range(0,size):
-            item={
-
-                "data_time_measure":"",
-                "data_value":"",
-                "measure_id":"",
-                "station_id":""
-            }
-            data=Data.query.filter(Data.assignedmeasure_id==all_assignedmeasures[i]["id"]).order_by(Data.data_time_measure.desc()).first()
-            x=data.serialize()
-
-            item["id"]=all_assignedmeasures[i]["id"]
-            item["data_time_measure"]=x["data_time_measure"]
-            item["data_value"]=x["data_value"]
-            item["measure_id"]=all_assignedmeasures[i]["measure_id"]
-            item["station_id"]=all_assignedmeasures[i]["station_id"]
-
-            lastdata.append(item)
-
-        if lastdata is None:
-            raise APIException('Values not found', status_code=404)
-
-        #lastdata = list(map(lambda x: x.serialize(), lastdata))
-        return jsonify(lastdata), 200
+        lastdata = latest_values()
+        return rows_response(lastdata), 200
 
     return "Invalid Method", 404
 
@@ -424,7 +682,9 @@ def get_assigned_measures(assignedmeasure_id):
         if values is None:
             raise APIException('Measure not found', status_code=404)
         db.session.delete(assignedmeasure1)
+        bump_version('assignedmeasure')
         db.session.commit()
+        invalidate_cache('assignedmeasure')
 
 
         return "ok", 200
@@ -432,6 +692,7 @@ def get_assigned_measures(assignedmeasure_id):
     return "Invalid Method", 404
 
 @app.route('/stations/<int:station_id>/measures', methods=['GET'])
+@versioned('assignedmeasure')
 def get_assigned_measure_from_station(station_id):
     """
     Trae medidas asignadas desde estación (GET)
@@ -442,10 +703,13 @@ def get_assigned_measure_from_station(station_id):
         measures = Assignedmeasure.query.filter_by(station_id=station_id)
         if measures is None:
             raise APIException('Measures not found', status_code=404)
+        if wants_stream():
+            return stream_json(measures)
         measures = list(map(lambda x: x.serialize(), measures))
-        return jsonify(measures), 200
+        return rows_response(measures), 200
 
 @app.route('/measures/<int:measure_id>/stations', methods=['GET'])
+@versioned('assignedmeasure')
 def get_stations_with_measures(measure_id):
     """
     Trae estaciones con la medición asignada (GET)
@@ -456,10 +720,265 @@ def get_stations_with_measures(measure_id):
         stations = Assignedmeasure.query.filter_by(measure_id=measure_id)
         if stations is None:
             raise APIException('Stations not found', status_code=404)
+        if wants_stream():
+            return stream_json(stations)
         stations = list(map(lambda x: x.serialize(), stations))
-        return jsonify(stations), 200
+        return rows_response(stations), 200
+
+
+
+####   Retención   ####
+
+
+def set_retention_days(policy, body):
+    for field in POLICY_FIELDS:
+        if field in body:
+            days = body[field]
+            if days is not None and (not isinstance(days, int) or isinstance(days, bool) or days <= 0):
+                raise APIException('%s must be a positive integer or null' % field, status_code=400)
+            setattr(policy, field, days)
+
+@app.route('/retentionpolicies', methods=['POST', 'GET'])
+def handle_retention_policies():
+    """
+    agrega una política de retención para una medida o una medición asignada (POST), trae la lista (GET)
+    """
+
+    # POST request
+    if request.method == 'POST':
+        body = request.get_json()
+
+        if body is None:
+            raise APIException("You need to specify the request body as a json object", status_code=400)
+        if ('measure_id' in body) == ('assignedmeasure_id' in body):
+            raise APIException('You need to specify either the measure_id or the assignedmeasure_id', status_code=400)
+
+        field, model = ('measure_id', Measure) if 'measure_id' in body else ('assignedmeasure_id', Assignedmeasure)
+        target = body[field]
+        if not isinstance(target, int) or isinstance(target, bool):
+            raise APIException('%s must be an integer' % field, status_code=400)
+        if model.query.get(target) is None:
+            raise APIException('%s %d not found' % (field, target), status_code=400)
+        if Retentionpolicy.query.filter(getattr(Retentionpolicy, field) == target).first() is not None:
+            raise APIException('There is already a retention policy for %s %d' % (field, target), status_code=409)
+
+        policy1 = Retentionpolicy(**{field: target})
+        set_retention_days(policy1, body)
+        db.session.add(policy1)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Otro request creó la misma política entre la consulta y el commit
+            db.session.rollback()
+            raise APIException('There is already a retention policy for %s %d' % (field, target), status_code=409)
+        return encode(policy1.serialize()), 200
+
+    # GET request
+    if request.method == 'GET':
+        all_policies = Retentionpolicy.query.all()
+        all_policies = list(map(lambda x: x.serialize(), all_policies))
+        return rows_response(all_policies), 200
+
+    return "Invalid Method", 404
+
+@app.route('/retentionpolicies/<int:policy_id>', methods=['PUT', 'DELETE', 'GET'])
+def get_single_retention_policy(policy_id):
+    """
+    edita una política de retención (PUT), la borra (DELETE) y la trae (GET)
+    """
+
+    policy1 = Retentionpolicy.query.get(policy_id)
+    if policy1 is None:
+        raise APIException('Retention policy not found', status_code=404)
+
+    # PUT request
+    if request.method == 'PUT':
+        body = request.get_json()
+        if body is None:
+            raise APIException("You need to specify the request body as a json object", status_code=400)
+        set_retention_days(policy1, body)
+        db.session.commit()
+        return encode(policy1.serialize()), 200
+
+    # DELETE request
+    if request.method == 'DELETE':
+        db.session.delete(policy1)
+        db.session.commit()
+        return "ok", 200
+
+    # GET request
+    if request.method == 'GET':
+        return encode(policy1.serialize()), 200
+
+    return "Invalid Method", 404
+
+@app.route('/data/storage', methods=['GET'])
+def handle_data_storage():
+    """
+    Trae lecturas crudas, agregados, rango de fechas y política de cada serie (GET)
+    """
+
+    # GET request
+    if request.method == 'GET':
+        return encode(storage_report()), 200
+
+    return "Invalid Method", 404
+
+
+####   Caché   ####
 
 
+@app.route('/cache/stats', methods=['GET'])
+def handle_cache_stats():
+    """
+    Trae aciertos, fallos y tamaño de cada caché en memoria de este worker (GET)
+    """
+
+    # GET request
+    if request.method == 'GET':
+        return encode(cache_stats()), 200
+
+    return "Invalid Method", 404
+
+
+####   Métricas   ####
+
+
+@app.route('/metrics', methods=['GET'])
+def handle_metrics():
+    """
+    Histogramas por endpoint de duración, consultas SQL, serialización y tamaño de respuesta
+    de este worker, en formato Prometheus (GET)
+    """
+
+    # GET request
+    if request.method == 'GET':
+        with timed_serialize():
+            body = render_metrics()
+        return body, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+    return "Invalid Method", 404
+
+
+####   Datos   ####
+
+
+@app.route('/data/batch', methods=['POST'])
+def handle_data_batch():
+    """
+    Agrega lecturas en lote (POST): array JSON o NDJSON de {assignedmeasure_id, data_time_measure, data_value}
+    """
+
+    # POST request
+    if request.method == 'POST':
+        inserted = ingest_readings(iter_request_records(request), chunk_size=app.config['DATA_BATCH_CHUNK_SIZE'])
+        return encode({"inserted": inserted}), 200
+
+    return "Invalid Method", 404
+
+
+@app.route('/data/buffer', methods=['POST', 'GET'])
+def handle_data_buffer():
+    """
+    Encola lecturas para insertarlas en segundo plano (POST, responde 202, 429 si la cola está llena
+    o 413 si el lote no entra ni con la cola vacía),
+    trae profundidad de la cola y tiempos de inserción de este worker (GET)
+    """
+
+    # POST request
+    if request.method == 'POST':
+        rows = []
+        known_ids = set()
+        records = iter_request_records(request)
+        while True:
+            chunk = list(itertools.islice(records, app.config['DATA_BATCH_CHUNK_SIZE']))
+            if not chunk:
+                break
+            rows.extend(validate_readings(chunk, len(rows), known_ids))
+            #Reintentar no serviría: el lote no entra nunca
+            if len(rows) > app.config['BUFFER_MAX_READINGS']:
+                raise APIException('You can queue at most %d readings per request, use /data/batch' % app.config['BUFFER_MAX_READINGS'], status_code=413)
+        if not write_behind.put(rows):
+            return encode({"message": "Ingestion buffer is full, retry later"}), 429, {'Retry-After': str(int(math.ceil(app.config['BUFFER_FLUSH_INTERVAL'])))}
+        return encode({"queued": len(rows)}), 202
+
+    # GET request
+    if request.method == 'GET':
+        return encode(write_behind.stats()), 200
+
+    return "Invalid Method", 404
+
+
+@app.route('/data/query', methods=['POST'])
+def handle_data_query():
+    """
+    Trae los datos de varias mediciones en una sola consulta (POST). Cuerpo: series (lista de
+    {assignedmeasure_id} o {station_id, measure_id}, cada una con date_from/date_to opcionales),
+    date_from y date_to compartidos, y opcionalmente bucket
+    """
+
+    # POST request
+    if request.method == 'POST':
+        body = request.get_json()
+
+        if body is None:
+            raise APIException("You need to specify the request body as a json object", status_code=400)
+        series = body.get('series')
+        if not isinstance(series, list) or not series:
+            raise APIException('You need to specify the series', status_code=400)
+        if len(series) > app.config['DATA_QUERY_MAX_SERIES']:
+            raise APIException('You can query at most %d series' % app.config['DATA_QUERY_MAX_SERIES'], status_code=400)
+        bucket = body.get('bucket')
+        if bucket is not None and bucket not in BUCKETS:
+            raise APIException('bucket must be one of %s' % ', '.join(BUCKETS), status_code=400)
+
+        ranges = []
+        for index, serie in enumerate(series):
+            if not isinstance(serie, dict) or not ('assignedmeasure_id' in serie or ('station_id' in serie and 'measure_id' in serie)):
+                raise APIException('You need to specify the assignedmeasure_id or the station_id and measure_id', status_code=400, payload={'index': index})
+            ids = [serie['assignedmeasure_id']] if 'assignedmeasure_id' in serie else [serie['station_id'], serie['measure_id']]
+            if any(not isinstance(x, int) or isinstance(x, bool) for x in ids):
+                raise APIException('assignedmeasure_id, station_id and measure_id must be integers', status_code=400, payload={'index': index})
+            datefrom = parse_datetime(serie.get('date_from', body.get('date_from')))
+            dateto = parse_datetime(serie.get('date_to', body.get('date_to')))
+            if datefrom is None or dateto is None:
+                raise APIException('You need to specify the date_from and date_to', status_code=400, payload={'index': index})
+            ranges.append((datefrom, dateto))
+
+        assignments = resolve_series(series)
+        missing = [index for index, assignment in enumerate(assignments) if assignment is None]
+        if missing:
+            raise APIException('Measure not found', status_code=404, payload={'index': missing})
+
+        if app.config['USE_ROLLUPS'] and bucket in BUCKET_RESOLUTION:
+            #Intervalos de una hora o más desde los agregados guardados, los bordes desde data
+            datas = multi_range_rollup_buckets([(assignment.id, datefrom, dateto) for assignment, (datefrom, dateto) in zip(assignments, ranges)], bucket)
+        else:
+            #Una serie pedida más de una vez se lee una sola vez con la unión de sus rangos
+            merged = {}
+            for assignment, (datefrom, dateto) in zip(assignments, ranges):
+                current = merged.get(assignment.id, (datefrom, dateto))
+                merged[assignment.id] = (min(current[0], datefrom), max(current[1], dateto))
+            values = multi_range_values(merged)
+            datas = []
+            for assignment, (datefrom, dateto) in zip(assignments, ranges):
+                rows = [row for row in values[assignment.id] if datefrom <= row.data_time_measure <= dateto]
+                if bucket is not None:
+                    datas.append(aggregate_buckets([(row.data_time_measure, row.data_value) for row in rows], bucket))
+                else:
+                    datas.append([{"id": row.id, "data_value": row.data_value, "data_time_measure": row.data_time_measure} for row in rows])
+        results = []
+        for assignment, data in zip(assignments, datas):
+            results.append({
+                "assignedmeasure_id": assignment.id,
+                "station_id": assignment.station_id,
+                "measure_id": assignment.measure_id,
+                "data": data
+            })
+        return encode(results), 200
+
+    return "Invalid Method", 404
+
 
 @app.route('/stations/fill', methods=['POST'])
 def fill_stations():
@@ -472,7 +991,9 @@ def fill_stations():
         for i in range(3):
             station1 = Station(name="Estación"+str(i+1), lattitude=str(i+1), longitude=str(i+2), person_id=1, description="", organization_id=1, streetaddress=str(i+1), numberaddress=str(i+1))
             db.session.add(station1)
+        bump_version('station')
         db.session.commit()
+        invalidate_cache('station')
         return "ok", 200
 
     return "Invalid Method", 404
@@ -488,7 +1009,9 @@ def fill_measures():
         for i in range(3):
             measures1 = Measure(name="medida"+str(i+1), unit="unidad"+str(i+1), symbol="símbolo"+str(i+1))
             db.session.add(measures1)
+        bump_version('measure')
         db.session.commit()
+        invalidate_cache('measure')
         return "ok", 200
 
     return "Invalid Method", 404
@@ -505,7 +1028,9 @@ def fill_assignedmeasures():
             for j in range(3):
                 assignedmeasure1 = Assignedmeasure(measure_id=i+1, station_id=j+1)
                 db.session.add(assignedmeasure1)
+        bump_version('assignedmeasure')
         db.session.commit()
+        invalidate_cache('assignedmeasure')
         return "ok", 200
 
     return "Invalid Method", 404
@@ -513,307 +1038,85 @@ def fill_assignedmeasures():
 @app.route('/data/fill', methods=['POST'])
 def fill_data():
     """
-    Llena con mediciones (POST)
+    Llena con mediciones sintéticas (POST). Cuerpo opcional con series o assignedmeasure_ids,
+    date_from, date_to, interval (segundos), waveform (random, sin, cos, sincos, mix),
+    amplitude, offset, noise, frequency y seed
     """
 
     # POST request
     if request.method == 'POST':
+        body = request.get_json(silent=True) or {}
+        inserted = fill_series(body, chunk_size=app.config['DATA_BATCH_CHUNK_SIZE'])
+        return encode({"inserted": inserted}), 200
 
-        month=0
-        for month in range (1,13):
-            if month == 1 or month ==3 or month==5 or month==7 or month==8 or month==10 or month==12:
-                lastday=32
-            elif month ==4 or month==6 or month==9 or month==11:
-                lastday=31
-            else:
-                lastday=29
-            for day in range (1,lastday):
-                for hour in range(0,24):
-                    if month<10:
-                        strmonth="0"+str(month)
-                    else:
-                        strmonth=str(month)
-
-                    if day<10:
-                        strday="0"+str(day)
-                    else:
-                        strday=str(day)
-
-                    if hour<10:
-                        strhour="0"+str(hour)
-                    else:
-                        strhour=str(hour)
-
-                    date="2018"+"-"+strmonth+"-"+strday+" "+strhour+":00:00"
-                    value=random.randint(-5,45)
-                    data1=Data(data_value=value, data_time_measure=date, assignedmeasure_id=1)
-                    db.session.add(data1)
-        db.session.commit()
-
-        x=0
-        for month in range (1,13):
-            if month == 1 or month ==3 or month==5 or month==7 or month==8 or month==10 or month==12:
-                lastday=32
-            elif month ==4 or month==6 or month==9 or month==11:
-                lastday=31
-            else:
-                lastday=29
-            for day in range (1,lastday):
-                for hour in range(0,24):
-                    if month<10:
-                        strmonth="0"+str(month)
-                    else:
-                        strmonth=str(month)
-
-                    if day<10:
-                        strday="0"+str(day)
-                    else:
-                        strday=str(day)
-
-                    if hour<10:
-                        strhour="0"+str(hour)
-                    else:
-                        strhour=str(hour)
-
-                    date="2018"+"-"+strmonth+"-"+strday+" "+strhour+":00:00"
-                    value=100*math.sin(x)
-                    x=x+1
-                    data1=Data(data_value=value, data_time_measure=date, assignedmeasure_id=2)
-                    db.session.add(data1)
-        db.session.commit()
-
-        x=0
-        for month in range (1,13):
-            if month == 1 or month ==3 or month==5 or month==7 or month==8 or month==10 or month==12:
-                lastday=32
-            elif month ==4 or month==6 or month==9 or month==11:
-                lastday=31
-            else:
-                lastday=29
-            for day in range (1,lastday):
-                for hour in range(0,24):
-                    if month<10:
-                        strmonth="0"+str(month)
-                    else:
-                        strmonth=str(month)
-
-                    if day<10:
-                        strday="0"+str(day)
-                    else:
-                        strday=str(day)
-
-                    if hour<10:
-                        strhour="0"+str(hour)
-                    else:
-                        strhour=str(hour)
-
-                    date="2018"+"-"+strmonth+"-"+strday+" "+strhour+":00:00"
-                    value=100*math.sin(x)-(random.randint(-5,45))/2
-                    x=x+1
-                    data1=Data(data_value=value, data_time_measure=date, assignedmeasure_id=3)
-                    db.session.add(data1)
-        db.session.commit()
-
-        month=0
-        x=0
-        for month in range (1,13):
-            if month == 1 or month ==3 or month==5 or month==7 or month==8 or month==10 or month==12:
-                lastday=32
-            elif month ==4 or month==6 or month==9 or month==11:
-                lastday=31
-            else:
-                lastday=29
-            for day in range (1,lastday):
-                for hour in range(0,24):
-                    if month<10:
-                        strmonth="0"+str(month)
-                    else:
-                        strmonth=str(month)
-
-                    if day<10:
-                        strday="0"+str(day)
-                    else:
-                        strday=str(day)
-
-                    if hour<10:
-                        strhour="0"+str(hour)
-                    else:
-                        strhour=str(hour)
-
-                    date="2018"+"-"+strmonth+"-"+strday+" "+strhour+":00:00"
-                    value=random.randint(-10,100)
-                    data1=Data(data_value=value, data_time_measure=date, assignedmeasure_id=4)
-                    db.session.add(data1)
-        db.session.commit()
-
-        x=0
-        for month in range (1,13):
-            if month == 1 or month ==3 or month==5 or month==7 or month==8 or month==10 or month==12:
-                lastday=32
-            elif month ==4 or month==6 or month==9 or month==11:
-                lastday=31
-            else:
-                lastday=29
-            for day in range (1,lastday):
-                for hour in range(0,24):
-                    if month<10:
-                        strmonth="0"+str(month)
-                    else:
-                        strmonth=str(month)
-
-                    if day<10:
-                        strday="0"+str(day)
-                    else:
-                        strday=str(day)
-
-                    if hour<10:
-                        strhour="0"+str(hour)
-                    else:
-                        strhour=str(hour)
-
-                    date="2018"+"-"+strmonth+"-"+strday+" "+strhour+":00:00"
-                    value=75*math.cos(x)
-                    x=x+1
-                    data1=Data(data_value=value, data_time_measure=date, assignedmeasure_id=5)
-                    db.session.add(data1)
-        db.session.commit()
-
-        x=0
-        for month in range (1,13):
-            if month == 1 or month ==3 or month==5 or month==7 or month==8 or month==10 or month==12:
-                lastday=32
-            elif month ==4 or month==6 or month==9 or month==11:
-                lastday=31
-            else:
-                lastday=29
-            for day in range (1,lastday):
-                for hour in range(0,24):
-                    if month<10:
-                        strmonth="0"+str(month)
-                    else:
-                        strmonth=str(month)
-
-                    if day<10:
-                        strday="0"+str(day)
-                    else:
-                        strday=str(day)
-
-                    if hour<10:
-                        strhour="0"+str(hour)
-                    else:
-                        strhour=str(hour)
-
-                    date="2018"+"-"+strmonth+"-"+strday+" "+strhour+":00:00"
-                    value=25*math.sin(x)+25*(random.randint(-5,45))
-                    x=x+1
-                    data1=Data(data_value=value, data_time_measure=date, assignedmeasure_id=6)
-                    db.session.add(data1)
-        db.session.commit()
-
-
-        for month in range (1,13):
-            if month == 1 or month ==3 or month==5 or month==7 or month==8 or month==10 or month==12:
-                lastday=32
-            elif month ==4 or month==6 or month==9 or month==11:
-                lastday=31
-            else:
-                lastday=29
-            for day in range (1,lastday):
-                for hour in range(0,24):
-                    if month<10:
-                        strmonth="0"+str(month)
-                    else:
-                        strmonth=str(month)
-
-                    if day<10:
-                        strday="0"+str(day)
-                    else:
-                        strday=str(day)
-
-                    if hour<10:
-                        strhour="0"+str(hour)
-                    else:
-                        strhour=str(hour)
-
-                    date="2018"+"-"+strmonth+"-"+strday+" "+strhour+":00:00"
-                    value=75+0.25*random.randint(-10,100)
-                    data1=Data(data_value=value, data_time_measure=date, assignedmeasure_id=7)
-                    db.session.add(data1)
-        db.session.commit()
-
-        x=0
-        for month in range (1,13):
-            if month == 1 or month ==3 or month==5 or month==7 or month==8 or month==10 or month==12:
-                lastday=32
-            elif month ==4 or month==6 or month==9 or month==11:
-                lastday=31
-            else:
-                lastday=29
-            for day in range (1,lastday):
-                for hour in range(0,24):
-                    if month<10:
-                        strmonth="0"+str(month)
-                    else:
-                        strmonth=str(month)
-
-                    if day<10:
-                        strday="0"+str(day)
-                    else:
-                        strday=str(day)
-
-                    if hour<10:
-                        strhour="0"+str(hour)
-                    else:
-                        strhour=str(hour)
-
-                    date="2018"+"-"+strmonth+"-"+strday+" "+strhour+":00:00"
-                    value=75*math.cos(x)
-                    x=x+1
-                    data1=Data(data_value=value, data_time_measure=date, assignedmeasure_id=8)
-                    db.session.add(data1)
-        db.session.commit()
-
-        x=0
-        for month in range (1,13):
-            if month == 1 or month ==3 or month==5 or month==7 or month==8 or month==10 or month==12:
-                lastday=32
-            elif month ==4 or month==6 or month==9 or month==11:
-                lastday=31
-            else:
-                lastday=29
-            for day in range (1,lastday):
-                for hour in range(0,24):
-                    if month<10:
-                        strmonth="0"+str(month)
-                    else:
-                        strmonth=str(month)
-
-                    if day<10:
-                        strday="0"+str(day)
-                    else:
-                        strday=str(day)
-
-                    if hour<10:
-                        strhour="0"+str(hour)
-                    else:
-                        strhour=str(hour)
-
-                    date="2018"+"-"+strmonth+"-"+strday+" "+strhour+":00:00"
-                    value=25*math.sin(x)+25*math.cos(x)
-                    x=x+1
-                    data1=Data(data_value=value, data_time_measure=date, assignedmeasure_id=9)
-                    db.session.add(data1)
-        db.session.commit()
+    return "Invalid Method", 404
 
 
-        return "ok", 200
+@app.cli.command('fill-data')
+@click.option('--series', type=int, help='Cantidad de series (por defecto todas)')
+@click.option('--date-from', default='2018-01-01T00:00:00')
+@click.option('--date-to', default='2019-01-01T00:00:00')
+@click.option('--interval', type=float, default=3600, help='Segundos entre muestras')
+@click.option('--waveform', type=click.Choice(WAVEFORMS))
+@click.option('--noise', type=float, default=0.0)
+@click.option('--seed', type=int)
+def fill_data_command(series, date_from, date_to, interval, waveform, noise, seed):
+    """
+    Llena la tabla data con series sintéticas sin pasar por una petición HTTP
+    """
+    options = {'date_from': date_from, 'date_to': date_to, 'interval': interval, 'noise': noise, 'seed': seed}
+    if series is not None:
+        options['series'] = series
+    if waveform is not None:
+        options['waveform'] = waveform
+    inserted = fill_series(options, chunk_size=app.config['DATA_BATCH_CHUNK_SIZE'])
+    click.echo('%d filas insertadas' % inserted)
+
+
+@app.cli.command('rebuild-rollups')
+@click.option('--assignedmeasure-id', type=int, multiple=True, help='Series a recalcular (por defecto todas)')
+def rebuild_rollups_command(assignedmeasure_id):
+    """
+    Recalcula desde data los agregados por hora y día
+    """
+    processed = rebuild_rollups(list(assignedmeasure_id))
+    click.echo('%d lecturas procesadas' % processed)
 
-    return "Invalid Method", 404
 
+@app.cli.command('create-partitions')
+@click.option('--ahead', type=int, default=3, help='Meses futuros a crear')
+def create_partitions_command(ahead):
+    """
+    Crea las particiones mensuales de data del mes actual y los siguientes (si data está particionada)
+    """
+    for name in create_future_partitions(ahead):
+        click.echo(name)
 
 
+@app.cli.command('drop-partitions')
+@click.option('--before', required=True, help='Primer mes a conservar, AAAA-MM')
+def drop_partitions_command(before):
+    """
+    Elimina las particiones mensuales de data anteriores a un mes
+    """
+    for name in drop_partitions(datetime.datetime.strptime(before, '%Y-%m')):
+        click.echo(name)
 
 
+@app.cli.command('compact-data')
+@click.option('--every', type=int, help='Repetir cada tantos segundos (proceso en segundo plano)')
+def compact_data_command(every):
+    """
+    Aplica las políticas de retención: resume y borra en lotes las lecturas y agregados vencidos
+    """
+    while True:
+        for result in compact(chunk_size=app.config['DATA_BATCH_CHUNK_SIZE']):
+            click.echo('serie %(assignedmeasure_id)d: %(aggregated)d agregadas, %(raw)d crudas, %(hourly)d por hora, %(daily)d por día' % result)
+            for day in result['skipped_days']:
+                click.echo('  %s conservado: agregados incompletos, correr rebuild-rollups' % day.date().isoformat())
+        if not every:
+            break
+        time.sleep(every)
 
 
 if __name__ == '__main__':
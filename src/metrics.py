@@ -0,0 +1,138 @@
+"""
+Instrumentación por request: cantidad y tiempo de consultas SQL, tiempo de serialización, tiempo total
+y tamaño de la respuesta. Se devuelven en el header Server-Timing y se acumulan en histogramas por
+endpoint que /metrics expone en formato de texto de Prometheus. Los valores son de cada worker.
+"""
+import contextlib
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+HISTOGRAMS = {
+    'http_request_duration_seconds': ('Duración del request', DURATION_BUCKETS),
+    'http_request_sql_queries': ('Consultas SQL por request', QUERY_BUCKETS),
+    'http_request_sql_duration_seconds': ('Tiempo en consultas SQL por request', DURATION_BUCKETS),
+    'http_request_serialize_duration_seconds': ('Tiempo de serialización por request', DURATION_BUCKETS),
+    'http_response_size_bytes': ('Tamaño de la respuesta', SIZE_BUCKETS),
+}
+
+lock = threading.Lock()
+# (métrica, endpoint, método) -> [conteos por bucket..., suma, cantidad]
+histograms = {}
+# (endpoint, método, status) -> cantidad
+requests_total = {}
+
+
+def observe(name, labels, value):
+    buckets = HISTOGRAMS[name][1]
+    key = (name,) + labels
+    with lock:
+        series = histograms.get(key)
+        if series is None:
+            series = histograms[key] = [0] * (len(buckets) + 2)
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if has_request_context() and starts:
+        g.sql_seconds = g.get('sql_seconds', 0.0) + time.perf_counter() - starts.pop()
+        g.sql_queries = g.get('sql_queries', 0) + 1
+
+
+@contextlib.contextmanager
+def timed_serialize():
+    """
+    Suma al request actual el tiempo del bloque como serialización
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context():
+            g.serialize_seconds = g.get('serialize_seconds', 0.0) + time.perf_counter() - started
+
+
+def format_labels(names, values):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in zip(names, values))
+
+
+def render_metrics():
+    """
+    Histogramas y contadores acumulados en el formato de texto de Prometheus
+    """
+    with lock:
+        snapshot = {key: list(series) for key, series in histograms.items()}
+        totals = dict(requests_total)
+
+    lines = ['# HELP http_requests_total Requests atendidos', '# TYPE http_requests_total counter']
+    for labels, count in sorted(totals.items()):
+        lines.append('http_requests_total{%s} %d' % (format_labels(('endpoint', 'method', 'status'), labels), count))
+
+    for name, (description, buckets) in HISTOGRAMS.items():
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s histogram' % name)
+        for key in sorted(k for k in snapshot if k[0] == name):
+            series = snapshot[key]
+            labels = format_labels(('endpoint', 'method'), key[1:])
+            for bound, count in zip(buckets, series):
+                lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, count))
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, series[-1]))
+            lines.append('%s_sum{%s} %s' % (name, labels, repr(float(series[-2]))))
+            lines.append('%s_count{%s} %d' % (name, labels, series[-1]))
+    return '\n'.join(lines) + '\n'
+
+
+def init_metrics(app):
+    """
+    Registra la instrumentación en la app. Debe llamarse antes que init_compression para medir
+    el tamaño final (comprimido) de la respuesta.
+    """
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_metrics(response):
+        if 'request_start' not in g:
+            return response
+        total = time.perf_counter() - g.request_start
+        sql_seconds = g.get('sql_seconds', 0.0)
+        sql_queries = g.get('sql_queries', 0)
+        serialize_seconds = g.get('serialize_seconds', 0.0)
+
+        response.headers['Server-Timing'] = 'db;dur=%.2f;desc="%d queries", serialize;dur=%.2f, total;dur=%.2f' % (
+            sql_seconds * 1000, sql_queries, serialize_seconds * 1000, total * 1000)
+
+        endpoint = request.endpoint or 'unmatched'
+        labels = (endpoint, request.method)
+        observe('http_request_duration_seconds', labels, total)
+        observe('http_request_sql_queries', labels, sql_queries)
+        observe('http_request_sql_duration_seconds', labels, sql_seconds)
+        observe('http_request_serialize_duration_seconds', labels, serialize_seconds)
+        # Las respuestas por partes no tienen tamaño conocido acá
+        if not response.is_streamed and response.content_length is not None:
+            observe('http_response_size_bytes', labels, response.content_length)
+        with lock:
+            key = labels + (response.status_code,)
+            requests_total[key] = requests_total.get(key, 0) + 1
+        return response
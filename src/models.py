@@ -1,6 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import validates
+from utils import parse_coordinate
+from routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class Organization(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -51,17 +54,34 @@ class Station(db.Model):
     person_id = db.Column(db.Integer, db.ForeignKey('person.id'), nullable=False)
     description = db.Column(db.String(250), unique=False, nullable=True)
     organization_id = db.Column(db.Integer, db.ForeignKey('organization.id'), nullable=False)
+    lat = db.Column(db.Float, unique=False, nullable=True)
+    lon = db.Column(db.Float, unique=False, nullable=True)
     assignedMeasures = db.relationship('Assignedmeasure')
 
+    __table_args__ = (
+        db.Index('ix_station_lat_lon', 'lat', 'lon'),
+    )
+
     def __repr__(self):
         return '<Station %r>' % self.name
 
+    @validates('lattitude', 'longitude')
+    def sync_coordinates(self, key, value):
+        # Copia numérica de las coordenadas de texto para las consultas espaciales
+        if key == 'lattitude':
+            self.lat = parse_coordinate(value, 90)
+        else:
+            self.lon = parse_coordinate(value, 180)
+        return value
+
     def serialize(self):
         return {
             "id": self.id,
             "name": self.name,
             "lattitude": self.lattitude,
             "longitude": self.longitude,
+            "lat": self.lat,
+            "lon": self.lon,
             "streetaddress": self.streetaddress,
             "numberaddress": self.numberaddress,
             "responsible": self.person_id,
@@ -74,7 +94,7 @@ class Measure(db.Model):
     name = db.Column(db.String(80), unique=False, nullable=False)
     unit = db.Column(db.String(20), unique=True, nullable=False)
     symbol = db.Column(db.String(10), unique=True, nullable=False)
-    assignedMeasures = db.relationship('Assignedmeasure')
+    assignedMeasures = db.relationship('Assignedmeasure', back_populates='measure')
 
     def __repr__(self):
         return '<Measure %r>' % self.name
@@ -91,6 +111,7 @@ class Assignedmeasure(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     measure_id = db.Column(db.Integer, db.ForeignKey('measure.id'), nullable=False)
     station_id = db.Column(db.Integer, db.ForeignKey('station.id'), nullable=False)
+    measure = db.relationship('Measure', back_populates='assignedMeasures')
     data = db.relationship('Data')
 
     def __repr__(self):
@@ -110,6 +131,11 @@ class Data(db.Model):
     data_time_measure = db.Column(db.DateTime, unique=False, nullable=False)
     assignedmeasure_id = db.Column(db.Integer, db.ForeignKey('assignedmeasure.id'), nullable=True)
 
+    # Las consultas por rango filtran por serie y luego por fecha
+    __table_args__ = (
+        db.Index('ix_data_assignedmeasure_id_data_time_measure', 'assignedmeasure_id', 'data_time_measure'),
+    )
+
     def __repr__(self):
         return '<Data %r>' % self.data_value
 
@@ -118,4 +144,72 @@ class Data(db.Model):
             "id":self.id,
             "data_value": self.data_value,
             "data_time_measure": self.data_time_measure
-        }
\ No newline at end of file
+        }
+class Datarollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    assignedmeasure_id = db.Column(db.Integer, db.ForeignKey('assignedmeasure.id'), nullable=False)
+    resolution = db.Column(db.String(10), unique=False, nullable=False)
+    data_time_measure = db.Column(db.DateTime, unique=False, nullable=False)
+    data_count = db.Column(db.Integer, unique=False, nullable=False)
+    data_sum = db.Column(db.Float, unique=False, nullable=False)
+    data_min = db.Column(db.Float, unique=False, nullable=False)
+    data_max = db.Column(db.Float, unique=False, nullable=False)
+    data_first = db.Column(db.Float, unique=False, nullable=False)
+    data_last = db.Column(db.Float, unique=False, nullable=False)
+    first_time = db.Column(db.DateTime, unique=False, nullable=False)
+    last_time = db.Column(db.DateTime, unique=False, nullable=False)
+
+    # Un registro por serie, resolución (hour, day) e intervalo; también sirve para leer por rango
+    __table_args__ = (
+        db.UniqueConstraint('assignedmeasure_id', 'resolution', 'data_time_measure'),
+    )
+
+    def __repr__(self):
+        return '<Datarollup %r %r>' % (self.resolution, self.data_time_measure)
+
+    def serialize(self):
+        return {
+            "data_time_measure": self.data_time_measure,
+            "min": self.data_min,
+            "max": self.data_max,
+            "avg": self.data_sum / self.data_count,
+            "count": self.data_count,
+            "first": self.data_first,
+            "last": self.data_last
+        }
+
+class Retentionpolicy(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    measure_id = db.Column(db.Integer, db.ForeignKey('measure.id'), unique=True, nullable=True)
+    assignedmeasure_id = db.Column(db.Integer, db.ForeignKey('assignedmeasure.id'), unique=True, nullable=True)
+    raw_days = db.Column(db.Integer, unique=False, nullable=True)
+    hourly_days = db.Column(db.Integer, unique=False, nullable=True)
+    daily_days = db.Column(db.Integer, unique=False, nullable=True)
+
+    def __repr__(self):
+        return '<Retentionpolicy %r>' % self.id
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "measure_id": self.measure_id,
+            "assignedmeasure_id": self.assignedmeasure_id,
+            "raw_days": self.raw_days,
+            "hourly_days": self.hourly_days,
+            "daily_days": self.daily_days
+        }
+
+class Tableversion(db.Model):
+    name = db.Column(db.String(80), primary_key=True)
+    version = db.Column(db.Integer, unique=False, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, unique=False, nullable=False)
+
+    def __repr__(self):
+        return '<Tableversion %r>' % self.name
+
+    def serialize(self):
+        return {
+            "name": self.name,
+            "version": self.version,
+            "updated_at": self.updated_at
+        }
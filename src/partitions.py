@@ -0,0 +1,115 @@
+"""
+Particiones mensuales de la tabla data (solo PostgreSQL, opcional: ver la migración e5b8a2f3c917).
+Con data particionada por rango de data_time_measure, borrar un mes completo es quitar su partición
+en vez de un DELETE de millones de filas.
+"""
+import datetime
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db
+
+PARTITION_FORMAT = 'data_%04d_%02d'
+state = {'partitioned': None, 'known': set()}
+
+
+def month_start(date):
+    return datetime.datetime(date.year, date.month, 1)
+
+
+def next_month(date):
+    return datetime.datetime(date.year + date.month // 12, date.month % 12 + 1, 1)
+
+
+def is_partitioned():
+    """
+    True si data es una tabla particionada de PostgreSQL; se consulta una vez por proceso
+    """
+    if state['partitioned'] is None:
+        if db.session.get_bind().dialect.name != 'postgresql':
+            state['partitioned'] = False
+        else:
+            relkind = db.session.execute(db.text("SELECT relkind FROM pg_class WHERE oid = 'data'::regclass")).scalar()
+            state['partitioned'] = relkind == 'p'
+    return state['partitioned']
+
+
+def reset_partition_state():
+    state['partitioned'] = None
+    state['known'] = set()
+
+
+def ensure_partitions(dates):
+    """
+    Crea (si faltan) las particiones de los meses de dates dentro de la transacción actual.
+    No hace nada si data no está particionada. Las nuevas se recuerdan recién cuando la
+    transacción se confirma: si se deshace, el CREATE TABLE también se deshace.
+    """
+    if not is_partitioned():
+        return
+    pending = db.session().info.setdefault('new_partitions', set())
+    for start in {month_start(date) for date in dates} - state['known'] - pending:
+        db.session.execute(db.text(
+            "CREATE TABLE IF NOT EXISTS %s PARTITION OF data FOR VALUES FROM ('%s') TO ('%s')"
+            % (PARTITION_FORMAT % (start.year, start.month), start.isoformat(), next_month(start).isoformat())))
+        pending.add(start)
+
+
+@event.listens_for(Session, 'after_commit')
+def remember_partitions(session):
+    state['known'].update(session.info.pop('new_partitions', ()))
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def forget_partitions(session, previous_transaction):
+    session.info.pop('new_partitions', None)
+
+
+def create_future_partitions(months_ahead):
+    """
+    Crea las particiones del mes actual y de los months_ahead meses siguientes
+    """
+    if not is_partitioned():
+        return []
+    start = month_start(datetime.datetime.utcnow())
+    dates = [start]
+    for _ in range(months_ahead):
+        dates.append(next_month(dates[-1]))
+    ensure_partitions(dates)
+    db.session.commit()
+    return [PARTITION_FORMAT % (x.year, x.month) for x in dates]
+
+
+def list_partitions():
+    """
+    Particiones de data con su mes, de la más antigua a la más nueva
+    """
+    rows = db.session.execute(db.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'data'::regclass ORDER BY c.relname"))
+    partitions = []
+    for (name,) in rows:
+        try:
+            partitions.append((name, datetime.datetime.strptime(name, 'data_%Y_%m')))
+        except ValueError:
+            pass
+    return partitions
+
+
+def drop_partitions(before):
+    """
+    Quita las particiones de los meses que terminan antes de before (operación de catálogo, sin DELETE).
+    Los agregados de datarollup se conservan. Devuelve los nombres eliminados.
+    """
+    if not is_partitioned():
+        return []
+    dropped = []
+    for name, start in list_partitions():
+        if next_month(start) <= before:
+            db.session.execute(db.text('ALTER TABLE data DETACH PARTITION %s' % name))
+            db.session.execute(db.text('DROP TABLE %s' % name))
+            state['known'].discard(start)
+            dropped.append(name)
+    db.session.commit()
+    return dropped
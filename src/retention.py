@@ -0,0 +1,180 @@
+"""
+Políticas de retención por medida o por medición asignada y compactación de datos viejos.
+Antes de borrar lecturas crudas se comprueba, hora por hora, que estén resumidas en datarollup:
+las horas sin agregados (USE_ROLLUPS=0, datos anteriores a la tabla) se agregan en ese momento
+y los días con agregados incompletos no se borran hasta correr rebuild-rollups.
+Los agregados vencen por su cuenta.
+"""
+import datetime
+
+from sqlalchemy import func
+
+from models import db, Assignedmeasure, Data, Datarollup, Retentionpolicy
+from rollups import update_rollups
+from timeseries import truncate
+
+POLICY_FIELDS = ('raw_days', 'hourly_days', 'daily_days')
+
+
+def series_policies():
+    """
+    Política efectiva de cada serie: la de la medición asignada o, si no tiene, la de su medida
+    """
+    by_measure = {}
+    by_serie = {}
+    for policy in Retentionpolicy.query.all():
+        if policy.assignedmeasure_id is not None:
+            by_serie[policy.assignedmeasure_id] = policy
+        else:
+            by_measure[policy.measure_id] = policy
+    policies = {}
+    for serie in db.session.query(Assignedmeasure.id, Assignedmeasure.measure_id):
+        policy = by_serie.get(serie.id) or by_measure.get(serie.measure_id)
+        if policy is not None:
+            policies[serie.id] = policy
+    return policies
+
+
+def delete_in_batches(model, condition, chunk_size):
+    """
+    Borra las filas que cumplen condition de a chunk_size por transacción, para no bloquear por mucho tiempo
+    """
+    deleted = 0
+    while True:
+        ids = [x.id for x in db.session.query(model.id).filter(condition).limit(chunk_size)]
+        if not ids:
+            return deleted
+        model.query.filter(model.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(ids)
+
+
+def raw_hour_counts(serie, cutoff):
+    """
+    {inicio de hora: lecturas crudas} de la serie antes de cutoff
+    """
+    condition = (Data.assignedmeasure_id == serie) & (Data.data_time_measure < cutoff)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        hour = func.date_trunc('hour', Data.data_time_measure)
+        return {x.start: x.count for x in db.session.query(hour.label('start'), func.count(Data.id).label('count')).filter(condition).group_by(hour)}
+    counts = {}
+    for (date,) in db.session.query(Data.data_time_measure).filter(condition).yield_per(10000):
+        start = truncate(date, 'hour')
+        counts[start] = counts.get(start, 0) + 1
+    return counts
+
+
+def aggregate_expiring(serie, cutoff, chunk_size):
+    """
+    Resume en datarollup las lecturas que vencen y todavía no están resumidas.
+    Devuelve (lecturas agregadas, días que no se pueden borrar porque sus agregados están incompletos)
+    """
+    raw = raw_hour_counts(serie, cutoff)
+    if not raw:
+        return 0, set()
+    summarized = {
+        x.data_time_measure: x.data_count
+        for x in db.session.query(Datarollup.data_time_measure, Datarollup.data_count)
+        .filter(Datarollup.assignedmeasure_id == serie)
+        .filter(Datarollup.resolution == 'hour')
+        .filter(Datarollup.data_time_measure < cutoff)
+    }
+    missing = {start for start in raw if start not in summarized}
+    # Una hora con menos lecturas resumidas que crudas no se puede completar sin duplicar
+    incomplete = {truncate(start, 'day') for start, count in raw.items() if 0 < summarized.get(start, 0) < count}
+    if not missing:
+        return 0, incomplete
+
+    aggregated = 0
+    rows = []
+    query = db.session.query(Data.data_time_measure, Data.data_value) \
+        .filter(Data.assignedmeasure_id == serie) \
+        .filter(Data.data_time_measure >= min(missing)) \
+        .filter(Data.data_time_measure < max(missing) + datetime.timedelta(hours=1))
+    for date, value in query.yield_per(chunk_size):
+        if truncate(date, 'hour') in missing:
+            rows.append({'assignedmeasure_id': serie, 'data_time_measure': date, 'data_value': value})
+        if len(rows) >= chunk_size:
+            update_rollups(rows)
+            aggregated += len(rows)
+            rows = []
+    if rows:
+        update_rollups(rows)
+        aggregated += len(rows)
+    db.session.commit()
+    return aggregated, incomplete
+
+
+def compact(now=None, chunk_size=5000):
+    """
+    Aplica las políticas: resume y borra lecturas crudas vencidas y borra agregados vencidos.
+    Los cortes se alinean al día para que nunca quede un día con parte de sus lecturas resumidas
+    y parte crudas. Devuelve por serie cuántas filas se agregaron y borraron de cada tipo y
+    los días que se conservaron crudos por tener agregados incompletos.
+    """
+    now = now or datetime.datetime.utcnow()
+    summary = []
+    for serie, policy in sorted(series_policies().items()):
+        result = {"assignedmeasure_id": serie, "aggregated": 0, "raw": 0, "hourly": 0, "daily": 0, "skipped_days": []}
+        if policy.raw_days is not None:
+            cutoff = truncate(now - datetime.timedelta(days=policy.raw_days), 'day')
+            result["aggregated"], skipped = aggregate_expiring(serie, cutoff, chunk_size)
+            # Se borra por tramos entre los días que se conservan
+            start = None
+            for day in sorted(skipped) + [cutoff]:
+                condition = (Data.assignedmeasure_id == serie) & (Data.data_time_measure < day)
+                if start is not None:
+                    condition = condition & (Data.data_time_measure >= start)
+                result["raw"] += delete_in_batches(Data, condition, chunk_size)
+                start = day + datetime.timedelta(days=1)
+            result["skipped_days"] = sorted(skipped)
+        for resolution, days in (('hour', policy.hourly_days), ('day', policy.daily_days)):
+            if days is not None:
+                cutoff = truncate(now - datetime.timedelta(days=days), 'day')
+                condition = (Datarollup.assignedmeasure_id == serie) & (Datarollup.resolution == resolution) & (Datarollup.data_time_measure < cutoff)
+                result["hourly" if resolution == 'hour' else "daily"] = delete_in_batches(Datarollup, condition, chunk_size)
+        summary.append(result)
+    return summary
+
+
+def storage_report():
+    """
+    Lecturas crudas, agregados y rango de fechas por serie; en PostgreSQL también el tamaño de las tablas
+    """
+    raw = {
+        x.assignedmeasure_id: x
+        for x in db.session.query(Data.assignedmeasure_id, func.count(Data.id).label('count'), func.min(Data.data_time_measure).label('oldest'), func.max(Data.data_time_measure).label('newest'))
+        .group_by(Data.assignedmeasure_id)
+    }
+    rollups = {
+        (x.assignedmeasure_id, x.resolution): x.count
+        for x in db.session.query(Datarollup.assignedmeasure_id, Datarollup.resolution, func.count(Datarollup.id).label('count'))
+        .group_by(Datarollup.assignedmeasure_id, Datarollup.resolution)
+    }
+    policies = series_policies()
+    series = []
+    for serie in Assignedmeasure.query.order_by(Assignedmeasure.id):
+        stats = raw.get(serie.id)
+        policy = policies.get(serie.id)
+        series.append({
+            "assignedmeasure_id": serie.id,
+            "station_id": serie.station_id,
+            "measure_id": serie.measure_id,
+            "raw_count": stats.count if stats else 0,
+            "oldest": stats.oldest if stats else None,
+            "newest": stats.newest if stats else None,
+            "hourly_count": rollups.get((serie.id, 'hour'), 0),
+            "daily_count": rollups.get((serie.id, 'day'), 0),
+            "policy": {name: getattr(policy, name) for name in POLICY_FIELDS} if policy else None
+        })
+
+    report = {"series": series}
+    if db.session.get_bind().dialect.name == 'postgresql':
+        report["tables"] = {
+            # Una tabla particionada no ocupa espacio propio: se suman sus particiones
+            name: int(db.session.execute(db.text(
+                "SELECT pg_total_relation_size(CAST(:name AS regclass)) + COALESCE((SELECT sum(pg_total_relation_size(inhrelid)) "
+                "FROM pg_inherits WHERE inhparent = CAST(:name AS regclass)), 0)"), {'name': name}).scalar())
+            for name in ('data', 'datarollup')
+        }
+    return report
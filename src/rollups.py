@@ -0,0 +1,277 @@
+"""
+Agregados por hora y por día de cada medición asignada (tabla datarollup).
+La ingesta los actualiza de forma incremental y rebuild_rollups los recalcula desde data.
+"""
+import datetime
+
+from sqlalchemy import case, func
+from sqlalchemy.dialects import postgresql, sqlite
+
+from utils import keyset_after
+from models import db, Assignedmeasure, Data, Datarollup
+from timeseries import multi_range_values, range_query, serialize_bucket, truncate
+
+RESOLUTIONS = ('hour', 'day')
+BUCKET_RESOLUTION = {'hour': 'hour', 'day': 'day', 'week': 'day', 'month': 'day'}
+STEP = {'hour': datetime.timedelta(hours=1), 'day': datetime.timedelta(days=1)}
+STATS = ('data_count', 'data_sum', 'data_min', 'data_max', 'data_first', 'data_last', 'first_time', 'last_time')
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def new_stats(date, value):
+    return {
+        'data_count': 1, 'data_sum': value, 'data_min': value, 'data_max': value,
+        'data_first': value, 'data_last': value, 'first_time': date, 'last_time': date
+    }
+
+
+def merge_stats(current, other):
+    """
+    Suma other a current; first/last se eligen por fecha, así el orden de llegada no importa
+    """
+    current['data_count'] += other['data_count']
+    current['data_sum'] += other['data_sum']
+    current['data_min'] = min(current['data_min'], other['data_min'])
+    current['data_max'] = max(current['data_max'], other['data_max'])
+    if other['first_time'] < current['first_time']:
+        current['data_first'], current['first_time'] = other['data_first'], other['first_time']
+    if other['last_time'] >= current['last_time']:
+        current['data_last'], current['last_time'] = other['data_last'], other['last_time']
+    return current
+
+
+def aggregate(rows, resolution):
+    """
+    Agrupa lecturas {assignedmeasure_id, data_time_measure, data_value} en {(assignedmeasure_id, inicio): stats}
+    """
+    groups = {}
+    for row in rows:
+        date = row['data_time_measure']
+        key = (row['assignedmeasure_id'], truncate(date, resolution))
+        stats = new_stats(date, row['data_value'])
+        if key in groups:
+            merge_stats(groups[key], stats)
+        else:
+            groups[key] = stats
+    return groups
+
+
+UPSERT_DIALECTS = {'postgresql': postgresql, 'sqlite': sqlite}
+
+
+def upsert_rollups(resolution, deltas):
+    """
+    INSERT ... ON CONFLICT DO UPDATE con la suma hecha en la base: dos ingestas concurrentes del mismo
+    intervalo se serializan sobre la fila en vez de fallar por la restricción única
+    """
+    dialect = db.session.get_bind().dialect.name
+    least, greatest = (func.least, func.greatest) if dialect == 'postgresql' else (func.min, func.max)
+    table = Datarollup.__table__
+    statement = UPSERT_DIALECTS[dialect].insert(table)
+    new = statement.excluded
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.assignedmeasure_id, table.c.resolution, table.c.data_time_measure],
+        set_={
+            'data_count': table.c.data_count + new.data_count,
+            'data_sum': table.c.data_sum + new.data_sum,
+            'data_min': least(table.c.data_min, new.data_min),
+            'data_max': greatest(table.c.data_max, new.data_max),
+            'data_first': case((new.first_time < table.c.first_time, new.data_first), else_=table.c.data_first),
+            'first_time': least(table.c.first_time, new.first_time),
+            'data_last': case((new.last_time >= table.c.last_time, new.data_last), else_=table.c.data_last),
+            'last_time': greatest(table.c.last_time, new.last_time),
+        }
+    )
+    # Siempre en el mismo orden para que dos transacciones no se bloqueen en cruz
+    db.session.execute(statement, [
+        dict(stats, assignedmeasure_id=serie, resolution=resolution, data_time_measure=start)
+        for (serie, start), stats in sorted(deltas.items())
+    ])
+
+
+def update_rollups(rows):
+    """
+    Suma un bloque de lecturas recién insertadas a los agregados, dentro de la transacción actual.
+    En PostgreSQL y SQLite con un upsert; en el resto los registros existentes se bloquean (FOR UPDATE).
+    """
+    for resolution in RESOLUTIONS:
+        deltas = aggregate(rows, resolution)
+        if not deltas:
+            continue
+        if db.session.get_bind().dialect.name in UPSERT_DIALECTS:
+            upsert_rollups(resolution, deltas)
+            continue
+        starts = [start for _, start in deltas]
+        existing = db.session.query(Datarollup.id, Datarollup.assignedmeasure_id, Datarollup.data_time_measure, *[getattr(Datarollup, name) for name in STATS]) \
+            .filter(Datarollup.resolution == resolution) \
+            .filter(Datarollup.assignedmeasure_id.in_({serie for serie, _ in deltas})) \
+            .filter(Datarollup.data_time_measure >= min(starts)) \
+            .filter(Datarollup.data_time_measure <= max(starts)) \
+            .with_for_update()
+        updates = []
+        for rollup in existing:
+            delta = deltas.pop((rollup.assignedmeasure_id, rollup.data_time_measure), None)
+            if delta is not None:
+                stats = merge_stats({name: getattr(rollup, name) for name in STATS}, delta)
+                stats['id'] = rollup.id
+                updates.append(stats)
+        if updates:
+            db.session.bulk_update_mappings(Datarollup, updates)
+        if deltas:
+            db.session.bulk_insert_mappings(Datarollup, [
+                dict(stats, assignedmeasure_id=serie, resolution=resolution, data_time_measure=start)
+                for (serie, start), stats in deltas.items()
+            ])
+
+
+def rollup_buckets(assignedmeasure_id, datefrom, dateto, bucket):
+    """
+    Igual que timeseries.bucket_values para hour/day/week/month pero leyendo los agregados.
+    Los intervalos que el rango cubre solo en parte se calculan desde data para que el resultado sea exacto.
+    """
+    resolution = BUCKET_RESOLUTION[bucket]
+    full_start = truncate(datefrom, resolution)
+    if full_start < datefrom:
+        full_start += STEP[resolution]
+    full_end = truncate(dateto + MICROSECOND, resolution)
+
+    groups = {}
+
+    def add(date, stats):
+        start = truncate(date, bucket)
+        if start in groups:
+            merge_stats(groups[start], stats)
+        else:
+            groups[start] = dict(stats)
+
+    if full_start >= full_end:
+        raw_ranges = [(datefrom, dateto)]
+    else:
+        raw_ranges = [(datefrom, full_start - MICROSECOND), (full_end, dateto)]
+        rollups = db.session.query(Datarollup.data_time_measure, *[getattr(Datarollup, name) for name in STATS]) \
+            .filter(Datarollup.assignedmeasure_id == assignedmeasure_id) \
+            .filter(Datarollup.resolution == resolution) \
+            .filter(Datarollup.data_time_measure >= full_start) \
+            .filter(Datarollup.data_time_measure < full_end)
+        for rollup in rollups:
+            add(rollup.data_time_measure, {name: getattr(rollup, name) for name in STATS})
+    for raw_from, raw_to in raw_ranges:
+        if raw_from <= raw_to:
+            for date, value in range_query(assignedmeasure_id, raw_from, raw_to, Data.data_time_measure, Data.data_value):
+                add(date, new_stats(date, value))
+
+    return serialize_stats(groups)
+
+
+def rollup_stats(assignedmeasure_ids, datefrom, dateto, bucket):
+    """
+    {assignedmeasure_id: {inicio del intervalo: estadísticas}} desde datarollup en una sola consulta
+    """
+    resolution = BUCKET_RESOLUTION[bucket]
+    rollups = db.session.query(Datarollup.assignedmeasure_id, Datarollup.data_time_measure, *[getattr(Datarollup, name) for name in STATS]) \
+        .filter(Datarollup.assignedmeasure_id.in_(assignedmeasure_ids)) \
+        .filter(Datarollup.resolution == resolution) \
+        .filter(Datarollup.data_time_measure >= datefrom) \
+        .filter(Datarollup.data_time_measure <= dateto)
+    groups = {serie: {} for serie in assignedmeasure_ids}
+    for rollup in rollups:
+        start = truncate(rollup.data_time_measure, bucket)
+        stats = {name: getattr(rollup, name) for name in STATS}
+        serie = groups[rollup.assignedmeasure_id]
+        if start in serie:
+            merge_stats(serie[start], stats)
+        else:
+            serie[start] = stats
+    return groups
+
+
+def serialize_stats(groups):
+    return [
+        serialize_bucket(start, s['data_min'], s['data_max'], s['data_sum'], s['data_count'], s['data_first'], s['data_last'])
+        for start, s in sorted(groups.items())
+    ]
+
+
+def multi_rollup_buckets(assignedmeasure_ids, datefrom, dateto, bucket):
+    """
+    Agregados por intervalo de varias series leyendo datarollup en una sola consulta.
+    datefrom debe estar alineada al intervalo y el último intervalo se devuelve completo,
+    así que no hace falta completar bordes desde data. Devuelve {assignedmeasure_id: [intervalos]}.
+    """
+    return {serie: serialize_stats(groups) for serie, groups in rollup_stats(assignedmeasure_ids, datefrom, dateto, bucket).items()}
+
+
+def multi_range_rollup_buckets(requests, bucket):
+    """
+    rollup_buckets para varias (assignedmeasure_id, desde, hasta) con pocas consultas: una a datarollup
+    por cada rango alineado distinto y dos a data para los bordes (inicios y finales), que se
+    calculan desde las lecturas para que el resultado sea exacto. Devuelve las listas en el orden pedido.
+    """
+    resolution = BUCKET_RESOLUTION[bucket]
+    plans = []
+    full_ranges = {}
+    edges = ({}, {})
+    for serie, datefrom, dateto in requests:
+        full_start = truncate(datefrom, resolution)
+        if full_start < datefrom:
+            full_start += STEP[resolution]
+        full_end = truncate(dateto + MICROSECOND, resolution)
+        if full_start >= full_end:
+            full, raw_ranges = None, [(datefrom, dateto)]
+        else:
+            full, raw_ranges = (full_start, full_end), [(datefrom, full_start - MICROSECOND), (full_end, dateto)]
+            full_ranges.setdefault(full, set()).add(serie)
+        # Una serie pedida más de una vez lee cada borde una sola vez con la unión de los rangos
+        for (raw_from, raw_to), ranges in zip(raw_ranges, edges):
+            if raw_from <= raw_to:
+                current = ranges.get(serie, (raw_from, raw_to))
+                ranges[serie] = (min(current[0], raw_from), max(current[1], raw_to))
+        plans.append((serie, full, [x for x in raw_ranges if x[0] <= x[1]]))
+
+    stats = {full: rollup_stats(sorted(series), full[0], full[1] - MICROSECOND, bucket) for full, series in full_ranges.items()}
+    values = [multi_range_values(ranges) if ranges else {} for ranges in edges]
+    results = []
+    for serie, full, raw_ranges in plans:
+        groups = {start: dict(s) for start, s in stats[full][serie].items()} if full else {}
+        for rows in values:
+            for row in rows.get(serie, ()):
+                if any(raw_from <= row.data_time_measure <= raw_to for raw_from, raw_to in raw_ranges):
+                    start = truncate(row.data_time_measure, bucket)
+                    if start in groups:
+                        merge_stats(groups[start], new_stats(row.data_time_measure, row.data_value))
+                    else:
+                        groups[start] = new_stats(row.data_time_measure, row.data_value)
+        results.append(serialize_stats(groups))
+    return results
+
+
+def rebuild_rollups(assignedmeasure_ids=None, chunk_size=10000):
+    """
+    Borra y recalcula desde data los agregados de las series indicadas (todas por defecto).
+    Los agregados anteriores al día de la lectura cruda más vieja se conservan: resumen lecturas
+    ya compactadas por la retención. Recorre cada serie por clave (data_time_measure, id) en bloques
+    y confirma al terminar cada serie. Devuelve la cantidad de lecturas procesadas.
+    """
+    query = db.session.query(Assignedmeasure.id).order_by(Assignedmeasure.id)
+    if assignedmeasure_ids:
+        query = query.filter(Assignedmeasure.id.in_(assignedmeasure_ids))
+    columns = [Data.data_time_measure, Data.id]
+    processed = 0
+    for serie in [x.id for x in query]:
+        oldest = db.session.query(func.min(Data.data_time_measure)).filter(Data.assignedmeasure_id == serie).scalar()
+        if oldest is None:
+            continue
+        Datarollup.query.filter_by(assignedmeasure_id=serie).filter(Datarollup.data_time_measure >= truncate(oldest, 'day')).delete(synchronize_session=False)
+        last = None
+        while True:
+            chunk = db.session.query(Data.data_time_measure, Data.id, Data.data_value).filter(Data.assignedmeasure_id == serie)
+            if last is not None:
+                chunk = chunk.filter(keyset_after(columns, last))
+            chunk = chunk.order_by(*columns).limit(chunk_size).all()
+            if not chunk:
+                break
+            update_rollups([{'assignedmeasure_id': serie, 'data_time_measure': x.data_time_measure, 'data_value': x.data_value} for x in chunk])
+            last = [chunk[-1].data_time_measure, chunk[-1].id]
+            processed += len(chunk)
+        db.session.commit()
+    return processed
@@ -0,0 +1,59 @@
+"""
+Ruteo de lecturas a una réplica: en los requests GET/HEAD las consultas van a la base de
+REPLICA_DB_CONNECTION_STRING (bind 'replica') y las escrituras siempre a la principal.
+Para leer lo recién escrito (read-your-writes) un request puede mandar X-Read-Your-Writes: 1,
+y después de cada escritura el cliente lee de la principal durante REPLICA_STICKY_SECONDS.
+"""
+import time
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+REPLICA_BIND = 'replica'
+READ_METHODS = ('GET', 'HEAD')
+STICKY_COOKIE = 'read_primary_until'
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not isinstance(clause, UpdateBase) and reads_from_replica():
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def reads_from_replica():
+    # Fuera de un request (CLI, hilo de ingesta diferida) todo va a la principal
+    return has_request_context() and g.get('read_replica', False)
+
+
+def read_your_writes():
+    if request.headers.get('X-Read-Your-Writes', '').lower() in ('1', 'true', 'yes'):
+        return True
+    until = request.cookies.get(STICKY_COOKIE)
+    try:
+        return until is not None and float(until) > time.time()
+    except ValueError:
+        return False
+
+
+def init_routing(app):
+    """
+    Registra el ruteo de lecturas en la app. Sin REPLICA_BIND en SQLALCHEMY_BINDS no cambia nada.
+    """
+    app.config.setdefault('REPLICA_STICKY_SECONDS', 5)
+    if REPLICA_BIND not in app.config.get('SQLALCHEMY_BINDS', {}):
+        return
+
+    @app.before_request
+    def choose_database():
+        g.read_replica = request.method in READ_METHODS and not read_your_writes()
+
+    @app.after_request
+    def stick_to_primary(response):
+        sticky = app.config['REPLICA_STICKY_SECONDS']
+        if request.method not in READ_METHODS + ('OPTIONS',) and response.status_code < 400 and sticky > 0:
+            response.set_cookie(STICKY_COOKIE, str(time.time() + sticky), max_age=int(sticky), httponly=True)
+        return response
@@ -0,0 +1,273 @@
+"""
+Consultas sobre las series de tiempo (tabla data) compartidas por los endpoints
+"""
+import datetime
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.dialects.postgresql import ARRAY, aggregate_order_by
+
+from models import db, Assignedmeasure, Data
+
+BUCKETS = ('minute', 'hour', 'day', 'week', 'month')
+BUCKET_SECONDS = {'minute': 60, 'hour': 3600, 'day': 86400, 'week': 7 * 86400, 'month': 31 * 86400}
+BUCKET_FIELDS = ('data_time_measure', 'min', 'max', 'avg', 'count', 'first', 'last')
+
+
+def range_query(assignedmeasure_id, datefrom, dateto, *columns):
+    """
+    Lecturas de una serie entre dos fechas (incluidas) ordenadas por fecha.
+    Filtra en el orden del índice (assignedmeasure_id, data_time_measure) para recorrerlo por rango,
+    y compara data_time_measure sin funciones para que PostgreSQL descarte las particiones fuera del rango.
+    """
+    query = db.session.query(*columns) if columns else Data.query
+    return query.filter(Data.assignedmeasure_id == assignedmeasure_id) \
+        .filter(Data.data_time_measure >= datefrom) \
+        .filter(Data.data_time_measure <= dateto) \
+        .order_by(Data.data_time_measure)
+
+
+def lttb(xs, ys, threshold):
+    """
+    Largest-Triangle-Three-Buckets: índices de threshold puntos que conservan la forma de la serie.
+    Se quedan siempre el primero y el último; de cada intervalo intermedio el punto que forma el
+    triángulo de mayor área con el elegido anterior y el promedio del intervalo siguiente.
+    """
+    size = len(xs)
+    if threshold >= size or threshold < 3:
+        return list(range(size))
+
+    every = (size - 2) / (threshold - 2)
+    indexes = [0]
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_start = end
+        next_end = min(int((i + 2) * every) + 1, size)
+        if i == threshold - 3:
+            next_start, next_end = size - 1, size
+        count = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / count
+        avg_y = sum(ys[next_start:next_end]) / count
+
+        ax, ay = xs[a], ys[a]
+        dx, dy = ax - avg_x, ay - avg_y
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs(dx * (ys[j] - ay) - (ax - xs[j]) * dy)
+            if area > best_area:
+                best, best_area = j, area
+        indexes.append(best)
+        a = best
+    indexes.append(size - 1)
+    return indexes
+
+
+def downsample(assignedmeasure_id, datefrom, dateto, max_points):
+    """
+    Lecturas de la serie reducidas a max_points con LTTB, con el mismo formato que Data.serialize()
+    """
+    rows = range_query(assignedmeasure_id, datefrom, dateto, Data.id, Data.data_time_measure, Data.data_value).all()
+    epoch = datetime.datetime(1970, 1, 1)
+    xs = [(row.data_time_measure - epoch).total_seconds() for row in rows]
+    ys = [row.data_value for row in rows]
+    return [
+        {"id": rows[i].id, "data_value": rows[i].data_value, "data_time_measure": rows[i].data_time_measure}
+        for i in lttb(xs, ys, max_points)
+    ]
+
+
+def truncate(date, bucket):
+    """
+    Trunca una fecha al inicio de su intervalo, igual que date_trunc de PostgreSQL (semanas desde el lunes)
+    """
+    if bucket == 'minute':
+        return date.replace(second=0, microsecond=0)
+    if bucket == 'hour':
+        return date.replace(minute=0, second=0, microsecond=0)
+    date = date.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == 'week':
+        return date - datetime.timedelta(days=date.weekday())
+    if bucket == 'month':
+        return date.replace(day=1)
+    return date
+
+
+def auto_bucket(datefrom, dateto, max_points):
+    """
+    El intervalo más fino cuya cantidad de agregados en el rango no supera max_points
+    """
+    span = (dateto - datefrom).total_seconds()
+    for bucket in BUCKETS:
+        if span / BUCKET_SECONDS[bucket] <= max_points:
+            return bucket
+    return BUCKETS[-1]
+
+
+def serialize_bucket(start, minimum, maximum, total, count, first, last):
+    return {
+        "data_time_measure": start,
+        "min": minimum,
+        "max": maximum,
+        "avg": total / count if count else None,
+        "count": count,
+        "first": first,
+        "last": last
+    }
+
+
+def bucket_values_sql(assignedmeasure_id, datefrom, dateto, bucket):
+    """
+    Agregados por intervalo calculados en PostgreSQL con GROUP BY date_trunc
+    """
+    start = func.date_trunc(bucket, Data.data_time_measure).label('start')
+
+    def ordered(order):
+        # Primer elemento de los valores ordenados por fecha: first (asc) o last (desc)
+        return func.array_agg(aggregate_order_by(Data.data_value, order), type_=ARRAY(db.Float))[1]
+
+    query = db.session.query(
+        start,
+        func.min(Data.data_value), func.max(Data.data_value), func.sum(Data.data_value), func.count(Data.data_value),
+        ordered(Data.data_time_measure.asc()), ordered(Data.data_time_measure.desc())
+    )
+    query = query.filter(Data.assignedmeasure_id == assignedmeasure_id) \
+        .filter(Data.data_time_measure >= datefrom) \
+        .filter(Data.data_time_measure <= dateto) \
+        .group_by(start) \
+        .order_by(start)
+    return [serialize_bucket(*row) for row in query]
+
+
+def aggregate_buckets(readings, bucket):
+    """
+    Agregados por intervalo en una sola pasada sobre pares (fecha, valor) ordenados por fecha
+    """
+    buckets = []
+    current = None
+    for date, value in readings:
+        start = truncate(date, bucket)
+        if current is None or current[0] != start:
+            if current is not None:
+                buckets.append(serialize_bucket(*current))
+            current = [start, value, value, 0.0, 0, value, value]
+        current[1] = min(current[1], value)
+        current[2] = max(current[2], value)
+        current[3] += value
+        current[4] += 1
+        current[6] = value
+    if current is not None:
+        buckets.append(serialize_bucket(*current))
+    return buckets
+
+
+def bucket_values_python(assignedmeasure_id, datefrom, dateto, bucket):
+    """
+    Agregados por intervalo calculados en Python sobre el rango ordenado (SQLite, MySQL)
+    """
+    readings = range_query(assignedmeasure_id, datefrom, dateto, Data.data_time_measure, Data.data_value).yield_per(10000)
+    return aggregate_buckets(readings, bucket)
+
+
+def resolve_series(series):
+    """
+    Busca en una sola consulta las mediciones asignadas pedidas por assignedmeasure_id o por
+    (station_id, measure_id). Devuelve una lista alineada con series, con None donde no existe.
+    """
+    conditions = [
+        Assignedmeasure.id == x['assignedmeasure_id'] if 'assignedmeasure_id' in x
+        else and_(Assignedmeasure.station_id == x['station_id'], Assignedmeasure.measure_id == x['measure_id'])
+        for x in series
+    ]
+    rows = db.session.query(Assignedmeasure.id, Assignedmeasure.station_id, Assignedmeasure.measure_id).filter(or_(*conditions)).all()
+    by_id = {row.id: row for row in rows}
+    by_pair = {}
+    for row in sorted(rows, key=lambda row: row.id, reverse=True):
+        by_pair[(row.station_id, row.measure_id)] = row
+    return [
+        by_id.get(x['assignedmeasure_id']) if 'assignedmeasure_id' in x else by_pair.get((x['station_id'], x['measure_id']))
+        for x in series
+    ]
+
+
+def multi_range_values(ranges):
+    """
+    Lecturas de varias series en una sola consulta. ranges: {assignedmeasure_id: (desde, hasta)}.
+    Si todas comparten el rango usa IN (...); si no, un OR de (serie, rango). Devuelve {assignedmeasure_id: [filas]}.
+    """
+    query = db.session.query(Data.assignedmeasure_id, Data.id, Data.data_time_measure, Data.data_value)
+    if len(set(ranges.values())) == 1:
+        datefrom, dateto = next(iter(ranges.values()))
+        query = query.filter(Data.assignedmeasure_id.in_(list(ranges))) \
+            .filter(Data.data_time_measure >= datefrom) \
+            .filter(Data.data_time_measure <= dateto)
+    else:
+        query = query.filter(or_(*[
+            and_(Data.assignedmeasure_id == serie, Data.data_time_measure >= datefrom, Data.data_time_measure <= dateto)
+            for serie, (datefrom, dateto) in ranges.items()
+        ]))
+    values = {serie: [] for serie in ranges}
+    for row in query.order_by(Data.assignedmeasure_id, Data.data_time_measure).yield_per(10000):
+        values[row.assignedmeasure_id].append(row)
+    return values
+
+
+def bucket_values(assignedmeasure_id, datefrom, dateto, bucket):
+    """
+    min/max/avg/count/first/last de la serie por intervalo (minute, hour, day, week, month)
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return bucket_values_sql(assignedmeasure_id, datefrom, dateto, bucket)
+    return bucket_values_python(assignedmeasure_id, datefrom, dateto, bucket)
+
+
+def latest_subquery(assignedmeasure_ids=None):
+    """
+    Subconsulta con la última lectura (assignedmeasure_id, data_time_measure, data_value) de cada serie.
+    En PostgreSQL usa DISTINCT ON; en el resto une contra MAX(data_time_measure) por serie,
+    que en ambos casos resuelve el índice (assignedmeasure_id, data_time_measure).
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        query = db.session.query(Data.assignedmeasure_id, Data.data_time_measure, Data.data_value) \
+            .distinct(Data.assignedmeasure_id) \
+            .order_by(Data.assignedmeasure_id, Data.data_time_measure.desc(), Data.id.desc())
+        if assignedmeasure_ids is not None:
+            query = query.filter(Data.assignedmeasure_id.in_(assignedmeasure_ids))
+        return query.subquery()
+
+    newest = db.session.query(Data.assignedmeasure_id.label('assignedmeasure_id'), func.max(Data.data_time_measure).label('data_time_measure')) \
+        .group_by(Data.assignedmeasure_id)
+    if assignedmeasure_ids is not None:
+        newest = newest.filter(Data.assignedmeasure_id.in_(assignedmeasure_ids))
+    newest = newest.subquery()
+    # Si dos lecturas comparten la fecha máxima se queda la de mayor id
+    newest_id = db.session.query(func.max(Data.id).label('id')) \
+        .join(newest, and_(Data.assignedmeasure_id == newest.c.assignedmeasure_id, Data.data_time_measure == newest.c.data_time_measure)) \
+        .group_by(Data.assignedmeasure_id) \
+        .subquery()
+    return db.session.query(Data.assignedmeasure_id, Data.data_time_measure, Data.data_value) \
+        .join(newest_id, Data.id == newest_id.c.id) \
+        .subquery()
+
+
+def latest_values(assignedmeasure_ids=None):
+    """
+    Última lectura de cada medición asignada en una sola consulta.
+    Las series sin datos vuelven con data_time_measure y data_value en None.
+    """
+    latest = latest_subquery(assignedmeasure_ids)
+    query = db.session.query(Assignedmeasure.id, Assignedmeasure.measure_id, Assignedmeasure.station_id, latest.c.data_time_measure, latest.c.data_value) \
+        .outerjoin(latest, latest.c.assignedmeasure_id == Assignedmeasure.id) \
+        .order_by(Assignedmeasure.id)
+    if assignedmeasure_ids is not None:
+        query = query.filter(Assignedmeasure.id.in_(assignedmeasure_ids))
+    return [
+        {
+            "id": row.id,
+            "data_time_measure": row.data_time_measure,
+            "data_value": row.data_value,
+            "measure_id": row.measure_id,
+            "station_id": row.station_id
+        }
+        for row in query
+    ]
@@ -1,4 +1,18 @@
-from flask import jsonify, url_for
+import base64
+import binascii
+import datetime
+from flask import jsonify, url_for, json, request, current_app, Response, stream_with_context
+from sqlalchemy import and_, or_, DateTime
+from metrics import timed_serialize
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+EPOCH = datetime.datetime(1970, 1, 1)
+DATETIME_FORMATS = ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%d %H:%M:%S.%f', '%Y%m%d%H%M%S')
 
 class APIException(Exception):
     status_code = 400
@@ -15,6 +29,170 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def parse_datetime(value):
+    """
+    Convierte una fecha ISO 8601 (sin zona) o AAAAMMDDhhmmss a datetime, None si no es válida
+    """
+    if isinstance(value, datetime.datetime):
+        return value
+    if not isinstance(value, str):
+        return None
+    value = value.rstrip('Z')
+    for fmt in DATETIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    return None
+
+def parse_coordinate(value, limit=180):
+    """
+    Convierte una coordenada en grados (número o texto, con coma o punto decimal) a float,
+    None si no es válida o está fuera de [-limit, limit]
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        value = value.strip().replace(',', '.')
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if -limit <= value <= limit else None
+
+def epoch_ms(date):
+    return (date - EPOCH) // datetime.timedelta(milliseconds=1)
+
+def response_mimetypes():
+    return ['application/json', MSGPACK_MIMETYPE] if msgpack is not None else ['application/json']
+
+def wants_msgpack():
+    return msgpack is not None and bool(request.accept_mimetypes) and request.accept_mimetypes.best_match(response_mimetypes()) == MSGPACK_MIMETYPE
+
+def wants_columns():
+    return request.args.get('format') == 'columns'
+
+def to_columns(rows):
+    """
+    Pasa una lista de dicts serializados a un dict de columnas: {"id": [...], "name": [...]}
+    """
+    keys = list(rows[0]) if rows else []
+    return {key: [row[key] for row in rows] for key in keys}
+
+def encode(payload):
+    """
+    JSON o MessagePack según el header Accept. En MessagePack las fechas van como epoch en milisegundos.
+    """
+    with timed_serialize():
+        if wants_msgpack():
+            default = lambda x: epoch_ms(x) if isinstance(x, datetime.datetime) else x
+            response = Response(msgpack.packb(payload, default=default, use_bin_type=True), mimetype=MSGPACK_MIMETYPE)
+        else:
+            response = jsonify(payload)
+    # El cuerpo depende del header Accept: las cachés intermedias tienen que distinguirlo
+    if msgpack is not None:
+        response.vary.add('Accept')
+    return response
+
+def series_columns(rows, fields=('data_time_measure', 'data_value')):
+    """
+    Columnas de lecturas o intervalos de una serie con los nombres del rango crudo:
+    data_time_measure pasa a "t" en epoch ms y data_value a "v"
+    """
+    names = {'data_time_measure': 't', 'data_value': 'v'}
+    columns = {names.get(key, key): [row[key] for row in rows] for key in fields}
+    columns['t'] = [epoch_ms(x) for x in columns['t']]
+    return columns
+
+def series_response(rows, fields=('data_time_measure', 'data_value')):
+    """
+    Como rows_response, pero con ?format=columns responde igual que el rango crudo ({"t": [...], ...})
+    """
+    return encode(series_columns(rows, fields)) if wants_columns() else rows_response(rows)
+
+def rows_response(rows):
+    """
+    Respuesta de una lista serializada, por filas o por columnas con ?format=columns
+    """
+    return encode(to_columns(rows) if wants_columns() else rows)
+
+def wants_stream():
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+def stream_json(query, serialize=lambda x: x.serialize()):
+    """
+    Responde un array JSON por partes (chunked) recorriendo la consulta en lotes con yield_per,
+    que en PostgreSQL usa un cursor del lado del servidor. La memoria no depende del tamaño del rango.
+    """
+    chunk_size = current_app.config.get('STREAM_CHUNK_SIZE', 1000)
+
+    def generate():
+        separator = '['
+        buffer = []
+        for item in query.yield_per(chunk_size):
+            buffer.append(json.dumps(serialize(item)))
+            if len(buffer) >= chunk_size:
+                yield separator + ','.join(buffer)
+                separator = ','
+                buffer = []
+        if buffer:
+            yield separator + ','.join(buffer)
+            separator = ','
+        yield ']' if separator == ',' else '[]'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+def wants_page():
+    return 'limit' in request.args or 'after' in request.args
+
+def encode_cursor(values):
+    values = [v.strftime('%Y-%m-%dT%H:%M:%S.%f') if isinstance(v, datetime.datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, columns):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError(cursor)
+        return [
+            datetime.datetime.strptime(v, '%Y-%m-%dT%H:%M:%S.%f') if isinstance(c.type, DateTime) else v
+            for c, v in zip(columns, values)
+        ]
+    except (ValueError, TypeError, binascii.Error):
+        raise APIException('Invalid cursor', status_code=400)
+
+def keyset_after(columns, values):
+    """
+    Condición (c1, c2, ...) > (v1, v2, ...) escrita con OR/AND para que funcione en cualquier motor
+    """
+    column, value = columns[0], values[0]
+    if len(columns) == 1:
+        return column > value
+    return or_(column > value, and_(column == value, keyset_after(columns[1:], values[1:])))
+
+def paginate(query, columns, serialize=lambda x: x.serialize()):
+    """
+    Paginación por clave (keyset) con ?limit= y el cursor opaco ?after=, ordenando por columns.
+    El costo es el de una página sin importar la profundidad; la siguiente página va en el header Link.
+    """
+    limit = request.args.get('limit', str(current_app.config.get('PAGE_DEFAULT_LIMIT', 100)))
+    max_limit = current_app.config.get('PAGE_MAX_LIMIT', 1000)
+    if not limit.isdigit() or not 0 < int(limit) <= max_limit:
+        raise APIException('limit must be an integer between 1 and %d' % max_limit, status_code=400)
+    limit = int(limit)
+
+    after = request.args.get('after')
+    if after:
+        query = query.filter(keyset_after(columns, decode_cursor(after, columns)))
+    items = query.order_by(None).order_by(*columns).limit(limit + 1).all()
+
+    response = rows_response([serialize(x) for x in items[:limit]])
+    if len(items) > limit:
+        args = request.args.to_dict()
+        args['after'] = encode_cursor([getattr(items[limit - 1], c.key) for c in columns])
+        response.headers['Link'] = '<%s>; rel="next"' % url_for(request.endpoint, **request.view_args, **args)
+    return response, 200
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
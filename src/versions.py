@@ -0,0 +1,84 @@
+"""
+Contadores de versión por tabla para responder GET condicionales (ETag / Last-Modified) con 304
+sin consultar ni serializar la tabla. Viven en la base para que todos los workers los compartan.
+"""
+import datetime
+import functools
+
+from flask import current_app, g, has_request_context, request
+
+from models import db, Tableversion
+from utils import wants_msgpack
+
+
+def bump_version(*names):
+    """
+    Incrementa la versión de las tablas dentro de la transacción actual; se confirma con el commit del handler
+    """
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    for name in names:
+        updated = Tableversion.query.filter_by(name=name).update({Tableversion.version: Tableversion.version + 1, Tableversion.updated_at: now}, synchronize_session=False)
+        if not updated:
+            db.session.add(Tableversion(name=name, version=1, updated_at=now))
+
+
+def current_versions(names):
+    """
+    ETag y fecha de última modificación de un conjunto de tablas en una sola consulta por clave primaria
+    """
+    rows = {x.name: x for x in Tableversion.query.filter(Tableversion.name.in_(names))}
+    versions = {name: rows[name].version if name in rows else 0 for name in names}
+    # Las cachés del request usan la misma versión que el ETag (ver table_version)
+    if has_request_context():
+        g.table_versions = dict(g.get('table_versions', {}), **versions)
+    etag = '-'.join('%s%d' % (name, versions[name]) for name in names)
+    updated_at = max([x.updated_at for x in rows.values()] or [datetime.datetime(1970, 1, 1)])
+    return etag, updated_at
+
+
+def table_version(name):
+    """
+    Versión actual de la tabla: la que ya leyó versioned en este request o una consulta por clave primaria
+    """
+    if has_request_context() and name in g.get('table_versions', {}):
+        return g.table_versions[name]
+    row = Tableversion.query.get(name)
+    return row.version if row is not None else 0
+
+
+def not_modified(etag, updated_at):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    if since is None:
+        return False
+    if since.tzinfo is not None:
+        since = since.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return updated_at <= since
+
+
+def versioned(*names):
+    """
+    Decorador para los GET que solo dependen de las tablas names: responde 304 si el cliente ya tiene
+    la versión actual y si no agrega ETag y Last-Modified a la respuesta. Con ?expand= la respuesta
+    depende también de otras tablas y se responde sin validación condicional.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or 'expand' in request.args:
+                return view(*args, **kwargs)
+            etag, updated_at = current_versions(names)
+            # JSON y MessagePack son representaciones distintas: cada una con su ETag
+            if wants_msgpack():
+                etag += '-msgpack'
+            if not_modified(etag, updated_at):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(view(*args, **kwargs))
+            response.set_etag(etag)
+            response.last_modified = updated_at
+            response.vary.add('Accept')
+            return response
+        return wrapper
+    return decorator
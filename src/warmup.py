@@ -0,0 +1,58 @@
+"""
+Arranque en caliente para gunicorn. Con preload_app el proceso principal importa la app,
+configura los mappers y, con WARM_CACHES=1, llena las cachés una sola vez; después cierra
+sus conexiones para que ningún worker herede un socket compartido. En post_fork cada worker
+descarta el pool heredado sin cerrarlo (close=False) y abre el suyo.
+"""
+import logging
+import os
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import configure_mappers
+
+from models import db
+from cache import cached_measures, cached_stations, prefill_assignments
+from timeseries import latest_values
+
+logger = logging.getLogger(__name__)
+
+
+def prefill_caches():
+    """
+    Llena las cachés de estaciones, medidas y asignaciones. latest_values no se guarda en caché
+    (cambia con cada lectura): se ejecuta una vez para compilar la consulta y abrir la conexión.
+    """
+    cached_stations()
+    cached_measures()
+    prefill_assignments()
+    latest_values()
+
+
+def dispose_engines(close=True):
+    for engine in db.engines.values():
+        engine.dispose(close=close)
+
+
+def warm_start(app):
+    """
+    Se llama al importar wsgi: en el proceso principal con preload_app, o en cada worker si no
+    """
+    configure_mappers()
+    with app.app_context():
+        if os.environ.get('WARM_CACHES', '0') == '1':
+            try:
+                prefill_caches()
+            except SQLAlchemyError:
+                # Sin base disponible se arranca en frío, igual que antes
+                logger.exception('cache prefill failed')
+            finally:
+                db.session.remove()
+        dispose_engines()
+
+
+def after_fork(app):
+    """
+    post_fork de gunicorn: el worker no reutiliza conexiones abiertas por el proceso principal
+    """
+    with app.app_context():
+        dispose_engines(close=False)
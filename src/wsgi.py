@@ -2,6 +2,9 @@
 # Read more about it here: https://devcenter.heroku.com/articles/python-gunicorn
 
 from main import app as application
+from warmup import warm_start
+
+warm_start(application)
 
 if __name__ == "__main__":
     application.run()